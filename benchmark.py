@@ -0,0 +1,391 @@
+import argparse
+import io
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from itertools import chain
+
+import pandas as pd
+
+import main
+import mock_server
+
+
+# 原先逐行apply的实现，作为对照组
+def mapBranchRowwise(df, id2name_dict):
+    def map_area(row):
+        for i in range(1, 6):
+            try:
+                area_id = row[f'areaid{i}']
+                if area_id in id2name_dict:
+                    return id2name_dict[area_id]
+            except KeyError:
+                continue
+        return ""
+
+    return df.apply(map_area, axis=1)
+
+
+def joinOrgPathRowwise(df):
+    return df[['lev1', 'lev2', 'lev3', 'lev4']].apply('-'.join, axis=1)
+
+
+# 生成rows条模拟名单数据，团支部分布在areaid3..5的不同层级
+def syntheticRoster(rows, branches=200, seed=0):
+    rng = random.Random(seed)
+    id2name_dict = {f'b{i}': f'团支部{i}' for i in range(branches)}
+    data = []
+    for i in range(rows):
+        branch = f'b{rng.randrange(branches)}'
+        level = rng.choice([3, 4, 5])
+        row = {'userid': f'u{i}', 'username': f'成员{i}',
+               'lev1': '共青团江西省委', 'lev2': '高校团工委', 'lev3': f'学院{i % 20}', 'lev4': f'团支部{i % branches}'}
+        for k in range(1, 6):
+            row[f'areaid{k}'] = branch if k == level else f'x{k}-{i % 50}'
+        # 少量成员不属于任何团支部
+        if rng.random() < 0.01:
+            row[f'areaid{level}'] = 'unknown'
+        data.append(row)
+    return pd.DataFrame(data), id2name_dict
+
+
+def timeit(func, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+# 对比逐行apply和向量化实现的耗时，并校验输出一致
+def benchTransform(sizes, repeat):
+    print(f"{'rows':>10} {'transform':>10} {'rowwise(s)':>12} {'vectorized(s)':>14} {'speedup':>8}")
+    for rows in sizes:
+        df, id2name_dict = syntheticRoster(rows)
+        cases = [
+            ('branch', lambda: mapBranchRowwise(df, id2name_dict), lambda: main.mapBranch(df, id2name_dict)),
+            ('orgPath', lambda: joinOrgPathRowwise(df), lambda: main.joinOrgPath(df)),
+        ]
+        for name, rowwise, vectorized in cases:
+            # 逐行实现太慢，只跑一次
+            slow, expected = timeit(rowwise, 1)
+            fast, actual = timeit(vectorized, repeat)
+            if expected.astype(str).tolist() != actual.astype(str).tolist():
+                raise AssertionError(f"{name} output differs at {rows} rows")
+            print(f"{rows:>10} {name:>10} {slow:>12.3f} {fast:>14.4f} {slow / fast:>7.1f}x")
+
+
+# 生成rows条模拟完成名单数据，按pageSize分页
+def syntheticFinishPages(rows, pageSize=1000, branches=200, seed=0):
+    rng = random.Random(seed)
+    pages = []
+    for start in range(0, rows, pageSize):
+        page = []
+        for i in range(start, min(start + pageSize, rows)):
+            branch = rng.randrange(branches)
+            page.append({
+                'id': i, 'classId': 68, 'score': 20, 'lev1': '共青团江西省委', 'lev2': '高校团工委',
+                'lev3': f'学院{branch % 20}', 'lev4': f'团支部{branch}', 'userid': f'u{i}', 'nid': f'b{branch}',
+                'subOrg': '', 'nid1': 'n1', 'nid2': 'n2', 'nid3': f'c{branch % 20}', 'status': 1, 'studyTime': 500,
+                'addTime': '2024-03-27 12:00:00', 'username': f'成员{i}'
+            })
+        pages.append(page)
+    return pages
+
+
+# 对比各导出格式的写入耗时和文件大小
+def benchFormats(sizes, formats):
+    print(f"{'rows':>10} {'format':>8} {'write(s)':>10} {'size(KB)':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in sizes:
+            pages = syntheticFinishPages(rows)
+            for fmt in formats:
+                filename = os.path.join(tmp, f'bench-{rows}.{main.EXPORTERS[fmt].ext}')
+                start = time.perf_counter()
+                try:
+                    main.exportFinish(pages, filename)
+                except RuntimeError as e:
+                    print(f"{rows:>10} {fmt:>8} skipped: {e}")
+                    continue
+                elapsed = time.perf_counter() - start
+                print(f"{rows:>10} {fmt:>8} {elapsed:>10.3f} {os.path.getsize(filename) / 1024:>10.1f}")
+
+
+# 模拟的HTTP响应，只提供logResponse需要的content属性
+class FakeResponse:
+    def __init__(self, content):
+        self.content = content
+
+
+# 在DEBUG级别下对本地模拟服务器登录，日志中不应出现token和姓名
+def checkLogRedaction():
+    cwd = os.getcwd()
+    server = mock_server.start()
+    stream = io.StringIO()
+    handler = main.setupLogging('DEBUG', stream=stream)
+    limit = main.LOG_BODY_LIMIT
+    with tempfile.TemporaryDirectory() as tmp:
+        # 登录状态文件写在临时目录中
+        os.chdir(tmp)
+        try:
+            main.API_BASE = server.apiBase
+            main.LOG_BODY_LIMIT = 4096
+            main.login('bench', 'bench')
+        finally:
+            os.chdir(cwd)
+            main.LOG_BODY_LIMIT = limit
+            main.logger.removeHandler(handler)
+            server.shutdown()
+            server.server_close()
+    log = stream.getvalue()
+    if '"token"' not in log:
+        raise AssertionError("login response was not logged")
+    if server.token in log:
+        raise AssertionError("login token appears in DEBUG log")
+    print("DEBUG log redaction: ok")
+
+
+# 对比不同日志配置下记录一个名单页响应的耗时
+def benchLogging(rows, repeat):
+    checkLogRedaction()
+    page = syntheticFinishPages(rows, pageSize=rows)[0]
+    response = FakeResponse(json.dumps({'code': 200, 'data': {'data': page}}, ensure_ascii=False).encode())
+    cases = [
+        ('INFO', 'INFO', 512),
+        ('DEBUG size only', 'DEBUG', 0),
+        ('DEBUG 512 chars', 'DEBUG', 512),
+        ('DEBUG full body', 'DEBUG', len(response.content)),
+    ]
+    print(f"page of {rows} rows, {len(response.content) / 1024:.1f}KB")
+    print(f"{'config':>16} {'per page(us)':>14} {'log bytes':>12}")
+    limit = main.LOG_BODY_LIMIT
+    with open(os.devnull, 'w', encoding='utf-8') as devnull:
+        try:
+            for name, level, bodyLimit in cases:
+                handler = main.setupLogging(level, stream=devnull)
+                main.LOG_BODY_LIMIT = bodyLimit
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    main.logResponse('record/getUserClassRecord', response)
+                elapsed = (time.perf_counter() - start) / repeat
+                print(f"{name:>16} {elapsed * 1e6:>14.1f} {handler.bytes // repeat:>12}")
+        finally:
+            main.LOG_BODY_LIMIT = limit
+            main.logger.removeHandler(handler)
+
+
+# 对比各JSON解码器解码一个名单页的耗时，compact为只保留导出需要的字段
+def benchJson(rows, repeat):
+    content = json.dumps({'code': 200, 'msg': '请求成功', 'data': {'page': {'totalPages': 1},
+                                                               'data': syntheticFinishPages(rows, rows)[0]}},
+                         ensure_ascii=False).encode()
+    print(f"page of {rows} rows, {len(content) / 1024:.1f}KB")
+    print(f"{'backend':>10} {'full(ms)':>10} {'compact(ms)':>12}")
+    backend = main._jsonBackend
+    expected = json.loads(content)
+    try:
+        for name, load in main.JSON_BACKENDS.items():
+            try:
+                main._jsonBackend = name, load()
+            except ImportError:
+                print(f"{name:>10} not installed")
+                continue
+            decoder = main.RowDecoder(main.FINISH_ROW_FIELDS)
+            full, actual = timeit(lambda: main.jsonLoads(content), repeat)
+            compact, projected = timeit(lambda: decoder(content), repeat)
+            if actual != expected:
+                raise AssertionError(f"{name} output differs")
+            if next(iter(projected['data']['data'])) != {field: expected['data']['data'][0][field]
+                                                         for field in main.FINISH_ROW_FIELDS}:
+                raise AssertionError(f"{name} compact output differs")
+            print(f"{name:>10} {full * 1000:>10.2f} {compact * 1000:>12.2f}")
+    finally:
+        main._jsonBackend = backend
+
+
+# 对比逐行dict和MemberTable保存名单的内存占用，以及生成DataFrame的耗时
+def benchRecords(sizes, repeat):
+    print(f"{'rows':>10} {'storage':>12} {'bytes/row':>10} {'frame(s)':>10}")
+    for rows in sizes:
+        # 经过一次JSON编解码，与接口返回的数据一样每行持有独立的字符串
+        contents = [json.dumps(page, ensure_ascii=False) for page in syntheticFinishPages(rows)]
+        cases = [
+            ('dicts', lambda page: page, lambda data: pd.DataFrame(list(chain.from_iterable(data)))),
+            ('MemberTable', main.MemberTable.fromRows, lambda data: main.MemberTable.concat(data).frame()),
+        ]
+        frames = []
+        for name, build, frame in cases:
+            tracemalloc.start()
+            data = [build(json.loads(content)) for content in contents]
+            size = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            elapsed, df = timeit(lambda: frame(data), repeat)
+            frames.append(df)
+            print(f"{rows:>10} {name:>12} {size / rows:>10.0f} {elapsed:>10.3f}")
+            data = None
+        pd.testing.assert_frame_equal(frames[0], frames[1])
+
+
+# 对本地模拟服务器完整运行一次登录、获取名单和导出，各规模的结果追加写入output
+def benchEndToEnd(sizes, kinds, fmt, latency, rowLatency, errorRate, pageSize, rate, output, compactRows=False):
+    print(f"{'members':>10} {'elapsed(s)':>11} {'requests':>9} {'retries':>8} {'rows':>8} {'rows/s':>9} "
+          f"{'maxrss(MB)':>11}")
+    cwd = os.getcwd()
+    main.setupLogging('WARNING')
+    pageSizeBefore, compactBefore = main.PAGE_SIZE, main.COMPACT_ROWS
+    try:
+        for members in sizes:
+            server = mock_server.start(members=members, latency=latency, rowLatency=rowLatency, errorRate=errorRate)
+            with tempfile.TemporaryDirectory() as tmp:
+                # 登录状态、缓存和导出文件都写在临时目录中，各规模互不影响
+                os.chdir(tmp)
+                try:
+                    main.API_BASE = server.apiBase
+                    main.PAGE_SIZE = pageSize
+                    main.COMPACT_ROWS = compactRows
+                    main.RESPONSE_CACHE.clear()
+                    main.RETRY_POLICY.reset()
+                    main.configureClient(rate=rate)
+                    main.METRICS.reset()
+                    start = time.perf_counter()
+                    cookies, token = main.login('bench', 'bench')
+                    files, failures = main.batchExport(cookies, token, 'latest', kinds, fmt=fmt)
+                    elapsed = time.perf_counter() - start
+                finally:
+                    os.chdir(cwd)
+                    server.shutdown()
+                    server.server_close()
+            counters = main.METRICS.counters
+            result = {
+                'time': datetime.now().isoformat(timespec='seconds'), 'members': members, 'kinds': kinds,
+                'format': fmt, 'pageSize': pageSize, 'compactRows': compactRows,
+                'json': main.jsonBackend()[0], 'latency': latency, 'rowLatency': rowLatency,
+                'errorRate': errorRate, 'rate': rate, 'elapsed': round(elapsed, 3),
+                'requests': sum(server.requests.values()) - server.requests.get('errors', 0),
+                'retries': int(counters.get('retries', 0)), 'rowsFetched': int(counters.get('rows fetched', 0)),
+                'files': len(files), 'failures': len(failures),
+                # ru_maxrss在Linux上以KB为单位，是整个进程的峰值
+                'maxrssMB': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            }
+            print(f"{members:>10} {elapsed:>11.2f} {result['requests']:>9} {result['retries']:>8} "
+                  f"{result['rowsFetched']:>8} {result['rowsFetched'] / elapsed:>9.0f} {result['maxrssMB']:>11.1f}")
+            if failures:
+                print(f"{members:>10} failed: {failures}")
+            if output:
+                with open(output, 'a', encoding='utf-8') as file:
+                    file.write(json.dumps(result, ensure_ascii=False) + '\n')
+    finally:
+        main.PAGE_SIZE, main.COMPACT_ROWS = pageSizeBefore, compactBefore
+
+
+# 导入main.py时不应加载的较重依赖
+HEAVY_MODULES = ['pandas', 'numpy', 'requests', 'questionary', 'cryptography', 'tqdm', 'xlsxwriter', 'pyarrow']
+
+
+# 用python -X importtime测量导入main.py的耗时（取多次中的最小值），超过预算或加载了较重的依赖时返回1
+def benchStartup(budget, repeat):
+    root = os.path.dirname(os.path.abspath(__file__))
+    code = "import sys, main; print(','.join(m for m in %r if m in sys.modules))" % (HEAVY_MODULES,)
+    best = None
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=root, capture_output=True,
+                                text=True, check=True)
+        # 每行格式为 import time: self | cumulative | name，子模块的name带缩进
+        imports = []
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            _, cumulative, name = line[len('import time:'):].split('|')
+            imports.append((int(cumulative), name.rstrip()))
+        # 子模块排在父模块之前，main之前到上一个顶层模块之间的都是main导入的
+        end = next(i for i, (_, name) in enumerate(imports) if name == ' main')
+        start = max((i for i in range(end) if not imports[i][1].startswith('  ')), default=-1) + 1
+        total = imports[end][0]
+        if best is None or total < best[0]:
+            best = total, imports[start:end], result.stdout.strip()
+    total, imports, loaded = best
+    print(f"import main: {total / 1000:.1f}ms (budget {budget:.0f}ms)")
+    # main直接导入的模块中耗时最多的几个
+    direct = [(cumulative, name.strip()) for cumulative, name in imports if not name.startswith('    ')]
+    for cumulative, name in sorted(direct, reverse=True)[:8]:
+        print(f"{name:>30} {cumulative / 1000:>8.1f}ms")
+    failed = False
+    if loaded:
+        print(f"heavy modules imported: {loaded}")
+        failed = True
+    if total / 1000 > budget:
+        print("over budget")
+        failed = True
+    return 1 if failed else 0
+
+
+def run(argv=None):
+    parser = argparse.ArgumentParser(description="导出流程的性能基准测试")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    transformParser = subparsers.add_parser('transform', help="团支部映射和组织路径拼接：逐行apply与向量化对比")
+    transformParser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    transformParser.add_argument('--repeat', type=int, default=3)
+
+    formatsParser = subparsers.add_parser('formats', help="各导出格式的写入耗时和文件大小")
+    formatsParser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000])
+    formatsParser.add_argument('--format', nargs='+', choices=list(main.EXPORTERS), default=list(main.EXPORTERS))
+
+    loggingParser = subparsers.add_parser('logging', help="不同日志配置下记录一个名单页响应的开销")
+    loggingParser.add_argument('--rows', type=int, default=1000)
+    loggingParser.add_argument('--repeat', type=int, default=200)
+
+    jsonParser = subparsers.add_parser('json', help="各JSON解码器解码一个名单页的耗时")
+    jsonParser.add_argument('--rows', type=int, default=1000)
+    jsonParser.add_argument('--repeat', type=int, default=50)
+
+    recordsParser = subparsers.add_parser('records', help="逐行dict与MemberTable的内存占用和DataFrame构建耗时")
+    recordsParser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000])
+    recordsParser.add_argument('--repeat', type=int, default=3)
+
+    startupParser = subparsers.add_parser('startup', help="导入main.py的耗时，超过预算时返回1")
+    startupParser.add_argument('--budget', type=float, default=150, help="导入耗时预算（毫秒）")
+    startupParser.add_argument('--repeat', type=int, default=5)
+
+    e2eParser = subparsers.add_parser('e2e', help="对本地模拟服务器的完整导出流程")
+    e2eParser.add_argument('--members', type=int, nargs='+', default=[1_000, 10_000, 100_000])
+    e2eParser.add_argument('--kind', nargs='+', choices=main.EXPORT_KINDS, default=list(main.EXPORT_KINDS))
+    e2eParser.add_argument('--format', choices=main.availableExporters(), default='xlsx')
+    e2eParser.add_argument('--latency', type=float, default=0.02, help="模拟服务器每个请求的固定延迟（秒）")
+    e2eParser.add_argument('--row-latency', type=float, default=0.00002, help="名单接口每返回一行增加的延迟（秒）")
+    e2eParser.add_argument('--error-rate', type=float, default=0.0, help="模拟服务器返回503的请求比例")
+    e2eParser.add_argument('--page-size', type=main.pageSizeArg, default=main.PAGE_SIZE, help="名单接口的分页大小，auto为自动选择")
+    e2eParser.add_argument('--rate', type=float, default=200, help="每秒最多请求数，0为不限制")
+    e2eParser.add_argument('--compact-rows', action='store_true', help="名单只解码导出需要的字段")
+    e2eParser.add_argument('--output', default='benchmark-e2e.jsonl', help="结果追加写入的文件，为空时不写入")
+
+    args = parser.parse_args(argv)
+    if args.command == 'transform':
+        benchTransform(args.rows, args.repeat)
+    elif args.command == 'formats':
+        benchFormats(args.rows, args.format)
+    elif args.command == 'logging':
+        benchLogging(args.rows, args.repeat)
+    elif args.command == 'json':
+        benchJson(args.rows, args.repeat)
+    elif args.command == 'records':
+        benchRecords(args.rows, args.repeat)
+    elif args.command == 'startup':
+        return benchStartup(args.budget, args.repeat)
+    elif args.command == 'e2e':
+        benchEndToEnd(args.members, args.kind, args.format, args.latency, args.row_latency, args.error_rate,
+                      args.page_size, args.rate, args.output, args.compact_rows)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run(sys.argv[1:]))
@@ -1,203 +1,1036 @@
+import argparse
 import base64
+import cProfile
+import functools
 import hashlib
+import importlib.util
 import json
 import logging
+import multiprocessing
 import os
 import pickle
-
-import pandas as pd
-import questionary
-import requests
-from cryptography.fernet import Fernet
-from tqdm import tqdm
-
-logging.basicConfig(level=logging.DEBUG)
-
-# 导出文件夹
+import random
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import datetime
+from email.utils import formatdate, parsedate_to_datetime
+from itertools import chain, count
+from urllib.parse import unquote, urlparse
+
+# pandas、requests、questionary等较重的依赖在第一次用到的函数中才导入，
+# 只查询人数等简单操作不需要加载它们；导入本模块也不会创建文件夹或修改日志设置
+
+# 日志：只使用jysc这个logger，由setupLogging在运行时配置，导入模块时不修改全局的日志设置
+logger = logging.getLogger('jysc')
+
+# 导出文件夹，第一次导出时创建
 output = '导出'
-if not os.path.exists('导出'):
-    os.mkdir('导出')
 
-# 自定义请求
-def doRequest(method, url, headers=None, data=None, cookies=None, max_retries=3, needCookie=False):
-    logging.debug(f"Requesting {method} {url}")
-    retries = 0
-    while retries < max_retries:
+# 日志级别
+LOG_LEVEL = os.environ.get('JYSC_LOG_LEVEL', 'INFO')
+# DEBUG级别下记录的响应内容最大长度，0为不记录响应内容
+LOG_BODY_LIMIT = int(os.environ.get('JYSC_LOG_BODY_LIMIT', 512))
+# DEBUG级别下每N个响应记录一次响应内容
+LOG_BODY_SAMPLE = int(os.environ.get('JYSC_LOG_BODY_SAMPLE', 1))
+
+# 接口地址，可以指向本地的模拟服务器（mock_server.py）
+API_BASE = os.environ.get('JYSC_API_BASE', "https://hm.jxqingtuan.cn/api-org/")
+# 分页并发请求数
+MAX_WORKERS = 8
+# 每秒最多发起的请求数，0为不限制
+REQUEST_RATE = float(os.environ.get('JYSC_RATE', 10))
+# 同时进行中的最大请求数
+MAX_IN_FLIGHT = int(os.environ.get('JYSC_MAX_IN_FLIGHT', 16))
+# 连接池大小，不小于最大并发请求数以保证每个请求都能复用连接
+POOL_SIZE = max(MAX_WORKERS, MAX_IN_FLIGHT)
+# 单次请求超时时间（秒）
+REQUEST_TIMEOUT = 30
+# 名单接口的分页大小，auto为根据历史测量自动选择
+PAGE_SIZE = os.environ.get('JYSC_PAGE_SIZE', '1000')
+PAGE_SIZE = PAGE_SIZE if PAGE_SIZE == 'auto' else int(PAGE_SIZE)
+# 自动选择分页大小时的候选值
+PAGE_SIZE_CANDIDATES = [200, 500, 1000, 2000, 5000]
+# 自动选择分页大小的测量数据
+TUNING_FILE = 'pagesize.json'
+# 名单只解码导出需要的字段，完成名单中大部分原本隐藏的列不再导出
+COMPACT_ROWS = os.environ.get('JYSC_COMPACT_ROWS') == '1'
+# 登录状态缓存文件
+SESSION_FILE = 'cookies.ptk'
+# 登录状态缓存有效期（秒），过期后重新登录
+SESSION_TTL = 12 * 60 * 60
+# 接口响应缓存文件
+CACHE_FILE = 'cache.ptk'
+# 增量导出使用的名单快照数据库
+SNAPSHOT_FILE = 'snapshot.db'
+# 当前期数据的缓存有效期（秒），已结束的期数永不过期
+CACHE_TTL = 5 * 60
+# 缓存的最大条目数，超过后淘汰最久未使用的条目
+CACHE_MAX_ENTRIES = 256
+
+
+# 性能统计：记录各阶段的耗时和计数，运行结束时汇总为性能报告
+class Metrics:
+    def __init__(self):
+        self.timings = defaultdict(list)
+        self.counters = defaultdict(float)
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+        with self._lock:
+            self.timings[name].append(seconds)
+
+    def add(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    # 装饰器：记录函数每次调用的耗时
+    def timed(self, name):
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    @staticmethod
+    def percentile(values, q):
+        values = sorted(values)
+        return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+    def reset(self):
+        with self._lock:
+            self.timings.clear()
+            self.counters.clear()
+            self.started = time.perf_counter()
+
+    def report(self):
+        with self._lock:
+            timings = {name: list(values) for name, values in self.timings.items()}
+            counters = dict(self.counters)
+        lines = [f"性能报告（总耗时 {time.perf_counter() - self.started:.2f}s）",
+                 f"{'name':<48} {'count':>6} {'total(s)':>9} {'p50(ms)':>9} {'p95(ms)':>9}"]
+        for name in sorted(timings):
+            values = timings[name]
+            lines.append(f"{name:<48} {len(values):>6} {sum(values):>9.3f} "
+                         f"{self.percentile(values, 0.5) * 1000:>9.1f} {self.percentile(values, 0.95) * 1000:>9.1f}")
+        for name in sorted(counters):
+            lines.append(f"{name:<48} {counters[name]:>6.0f}")
+        # 吞吐量
+        for rowsName, timeName in (('rows fetched', 'pagination'), ('rows written', 'write')):
+            seconds = sum(sum(values) for name, values in timings.items() if name.startswith(timeName + ' '))
+            if counters.get(rowsName) and seconds:
+                lines.append(f"{rowsName + ' per second':<48} {counters[rowsName] / seconds:>6.0f}")
+        return '\n'.join(lines)
+
+
+# 全局共享的性能统计
+METRICS = Metrics()
+timed = METRICS.timed
+
+
+# 客户端限速和自适应并发控制，所有经过doRequest的请求共享：
+# 令牌桶限制每秒请求数，同时限制进行中的请求数；遇到429/5xx、网络错误或延迟明显升高时
+# 将并发上限和请求速率减半，响应正常时逐步恢复到配置的上限。
+# 同一接口不同分页大小的响应耗时差别很大，延迟按响应大小折算为每字节耗时后再与基准比较
+class RateLimiter:
+    # 折算时响应大小的下限：小响应的耗时主要是固定开销，不按大小折算
+    MIN_BYTES = 64 * 1024
+    # 基准的平滑系数，以及开始判断延迟升高前需要的样本数
+    BASELINE_ALPHA = 0.2
+    BASELINE_SAMPLES = 3
+
+    def __init__(self, rate=REQUEST_RATE, maxInFlight=MAX_IN_FLIGHT, burst=None, latencyFactor=3.0):
+        self.maxRate = rate
+        self.rate = rate
+        self.burst = burst or max(1.0, rate or 1.0)
+        self.tokens = self.burst
+        self.maxInFlight = maxInFlight
+        self.limit = float(maxInFlight)
+        self.inFlight = 0
+        self.latencyFactor = latencyFactor
+        # 各接口的基准（每字节耗时的平滑值, 样本数），接口之间的延迟差别很大，需要分开统计
+        self.baselines = {}
+        self.throttled = 0
+        self._last = time.monotonic()
+        self._cond = threading.Condition()
+
+    def _refill(self, now):
+        if self.rate:
+            self.tokens = min(self.burst, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    # 等待并发名额和令牌
+    def acquire(self):
+        with self._cond:
+            while self.inFlight >= max(1, int(self.limit)):
+                self._cond.wait()
+            self.inFlight += 1
+            if not self.rate:
+                return
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                self._cond.wait((1 - self.tokens) / self.rate)
+
+    # 请求结束后根据结果调整并发上限和速率，size为响应字节数
+    def release(self, key, latency, overloaded=False, size=0):
+        with self._cond:
+            self.inFlight -= 1
+            cost = latency / max(size, self.MIN_BYTES)
+            baseline, samples = self.baselines.get(key, (None, 0))
+            slow = samples >= self.BASELINE_SAMPLES and cost > baseline * self.latencyFactor
+            if overloaded or slow:
+                self.throttled += 1
+                self.limit = max(1.0, self.limit / 2)
+                if self.rate:
+                    self.rate = max(self.maxRate / 16, self.rate / 2)
+            else:
+                self.limit = min(float(self.maxInFlight), self.limit + 1 / self.limit)
+                if self.rate:
+                    self.rate = min(self.maxRate, self.rate + self.maxRate / 20)
+            if not overloaded:
+                # 基准双向平滑跟随，个别特别快或特别慢的响应不会使基准突变
+                if baseline is not None:
+                    cost = baseline + (cost - baseline) * self.BASELINE_ALPHA
+                self.baselines[key] = cost, samples + 1
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {'rate': round(self.rate or 0, 2), 'inFlightLimit': int(self.limit), 'throttled': self.throttled}
+
+
+# 接口客户端：持有一个带连接池的requests.Session，统一管理Authorization和cookies
+class ApiClient:
+    def __init__(self, poolSize=POOL_SIZE, timeout=REQUEST_TIMEOUT, rate=REQUEST_RATE, maxInFlight=MAX_IN_FLIGHT):
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=poolSize, pool_maxsize=poolSize)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({'content-type': 'application/json'})
+        self.timeout = timeout
+        self.token = None
+        self.account = None
+        self.limiter = RateLimiter(rate, maxInFlight)
+        # 当前线程最近一次请求的耗时和响应大小
+        self.last = threading.local()
+        self._lock = threading.Lock()
+
+    # 设置默认的登录凭据，之后的请求不再需要手动传入
+    def setAuth(self, token, cookies=None, account=None):
+        with self._lock:
+            self.token = token
+            if account:
+                self.account = account
+            if token:
+                self.session.headers['Authorization'] = token
+            else:
+                self.session.headers.pop('Authorization', None)
+            if cookies:
+                self.session.cookies.update(cookies)
+
+    def request(self, method, url, headers=None, data=None, cookies=None, token=None):
+        if token and token != self.token:
+            self.setAuth(token, cookies)
+        if method.lower() not in ('get', 'post'):
+            raise ValueError("Unsupported HTTP method")
+        key = urlparse(url).path
+        self.limiter.acquire()
+        start = time.monotonic()
+        overloaded = True
+        self.last.bytes = 0
         try:
             if method.lower() == 'get':
-                response = requests.get(url, headers=headers, params=data, cookies=cookies)
-            elif method.lower() == 'post':
-                response = requests.post(url, headers=headers, data=data, cookies=cookies)
+                response = self.session.get(url, headers=headers, params=data, cookies=cookies, timeout=self.timeout)
             else:
-                raise ValueError("Unsupported HTTP method")
+                response = self.session.post(url, headers=headers, data=data, cookies=cookies, timeout=self.timeout)
+            overloaded = response.status_code == 429 or response.status_code >= 500
+            self.last.bytes = len(response.content)
+            METRICS.add('bytes ' + key, self.last.bytes)
+            return response
+        finally:
+            self.last.latency = time.monotonic() - start
+            self.limiter.release(key, self.last.latency, overloaded, self.last.bytes)
+            METRICS.record('http ' + key, self.last.latency)
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_clientLock = threading.Lock()
+
+
+# 获取全局共享的接口客户端
+def getClient():
+    global _client
+    with _clientLock:
+        if _client is None:
+            _client = ApiClient()
+        return _client
+
+
+# 按新的连接池大小和超时时间重建全局客户端，保留已有的登录凭据
+def configureClient(poolSize=POOL_SIZE, timeout=REQUEST_TIMEOUT, rate=REQUEST_RATE, maxInFlight=MAX_IN_FLIGHT):
+    global _client
+    with _clientLock:
+        old = _client
+        _client = ApiClient(poolSize, timeout, rate, maxInFlight)
+        if old is not None:
+            _client.setAuth(old.token, old.session.cookies, old.account)
+            old.close()
+        return _client
+
+
+# 统计日志输出的耗时和字节数，用于衡量日志本身的开销
+class TimedStreamHandler(logging.StreamHandler):
+    def __init__(self, stream=None):
+        super().__init__(stream)
+        self.records = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def format(self, record):
+        message = super().format(record)
+        self.bytes += len(message.encode('utf-8', errors='replace')) + 1
+        return message
+
+    def emit(self, record):
+        start = time.perf_counter()
+        super().emit(record)
+        self.seconds += time.perf_counter() - start
+        self.records += 1
+
+    def stats(self):
+        return {'records': self.records, 'bytes': self.bytes, 'seconds': round(self.seconds, 4)}
+
+
+# 结构化日志：每条日志输出为一行JSON
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage()
+        }
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+_logHandler = None
+
+
+# 配置日志级别和格式（text或json），重复调用时替换之前的配置
+def setupLogging(level=None, fmt='text', stream=None):
+    global _logHandler
+    level = (level or LOG_LEVEL).upper()
+    if _logHandler is not None:
+        logger.removeHandler(_logHandler)
+    _logHandler = TimedStreamHandler(stream)
+    if fmt == 'json':
+        _logHandler.setFormatter(JsonFormatter())
+    else:
+        _logHandler.setFormatter(logging.Formatter('%(levelname)s:%(name)s:%(message)s'))
+    logger.addHandler(_logHandler)
+    logger.setLevel(level)
+    logger.propagate = False
+    return _logHandler
+
+
+# 日志输出的开销统计
+def logStats():
+    return _logHandler.stats() if _logHandler is not None else {}
+
+
+# 响应内容中的姓名、登录token和密码替换为***
+_SENSITIVE_PATTERN = re.compile(r'("(?:username|userName|token|password)"\s*:\s*")[^"]*("|$)')
+_bodyCounter = count()
+
+
+# 在DEBUG级别下记录响应内容：截断、抽样并隐去姓名和token，未开启DEBUG时不做任何格式化
+def logResponse(url, response):
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    size = len(response.content)
+    if LOG_BODY_LIMIT <= 0 or next(_bodyCounter) % max(1, LOG_BODY_SAMPLE):
+        logger.debug("Response %s: %d bytes", url, size)
+        return
+    body = response.content[:LOG_BODY_LIMIT].decode('utf-8', errors='replace')
+    body = _SENSITIVE_PATTERN.sub(r'\1***\2', body)
+    suffix = f"...({size} bytes)" if size > LOG_BODY_LIMIT else ""
+    logger.debug("Response %s: %s%s", url, body, suffix)
+
+
+# 请求错误的基类
+class RequestError(Exception):
+    pass
+
+
+# 可重试的错误：网络异常、超时、HTTP 429/5xx、响应无法解析
+class RetryableError(RequestError):
+    def __init__(self, message, retryAfter=None):
+        super().__init__(message)
+        self.retryAfter = retryAfter
+
+
+# 不可重试的错误：其他HTTP错误码等，重试也不会成功
+class FatalError(RequestError):
+    pass
+
+
+# 业务逻辑错误（code不为200），例如账号或密码错误
+class ApiError(FatalError):
+    def __init__(self, code, msg):
+        super().__init__(f"API error: {msg}")
+        self.code = code
+        self.msg = msg
+
+
+# 需要重试的HTTP响应码
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+# 重试策略：指数退避 + 随机抖动，支持Retry-After，并限制单次运行的总重试次数
+class RetryPolicy:
+    def __init__(self, maxAttempts=3, baseDelay=0.5, maxDelay=30.0, multiplier=2.0, jitter=True, budget=100):
+        self.maxAttempts = maxAttempts
+        self.baseDelay = baseDelay
+        self.maxDelay = maxDelay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.budget = budget
+        self.spent = 0
+        self._lock = threading.Lock()
+
+    # 第attempt次失败后的等待时间（秒）
+    def delay(self, attempt, retryAfter=None):
+        if retryAfter is not None:
+            return min(max(retryAfter, 0.0), self.maxDelay)
+        backoff = min(self.maxDelay, self.baseDelay * self.multiplier ** (attempt - 1))
+        if self.jitter:
+            # full jitter，避免多个客户端同时重试
+            return random.uniform(0, backoff)
+        return backoff
+
+    # 从重试预算中扣除一次，预算用完返回False
+    def consume(self):
+        with self._lock:
+            if self.budget is not None and self.spent >= self.budget:
+                return False
+            self.spent += 1
+            return True
+
+    def reset(self):
+        with self._lock:
+            self.spent = 0
+
+
+# 全局共享的重试策略，重试预算在整次运行内累计
+RETRY_POLICY = RetryPolicy()
+
+
+# 解析Retry-After响应头，支持秒数和HTTP日期两种格式
+def parseRetryAfter(value):
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        retryAt = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return (retryAt - datetime.now(retryAt.tzinfo)).total_seconds()
+
+
+# JSON解码器：JYSC_JSON为auto时依次尝试orjson、msgspec，都未安装时使用标准库json
+JSON_BACKEND = os.environ.get('JYSC_JSON', 'auto')
+
+
+def _orjsonLoads():
+    import orjson
+    return orjson.loads
+
+
+# msgspec的DecodeError不是ValueError的子类，统一转换为ValueError，与json、orjson一致
+def _msgspecLoads():
+    import msgspec
+    decode = msgspec.json.Decoder().decode
 
-            # 检查HTTP响应码
-            if response.status_code != 200:
-                raise Exception(f"HTTP error: {response.status_code}")
+    def loads(content):
+        try:
+            return decode(content)
+        except msgspec.DecodeError as e:
+            raise ValueError(str(e)) from e
+    return loads
+
+
+JSON_BACKENDS = {'orjson': _orjsonLoads, 'msgspec': _msgspecLoads, 'json': lambda: json.loads}
+_jsonBackend = None
+
+
+# 返回(名称, loads函数)，第一次调用时确定使用的解码器
+def jsonBackend():
+    global _jsonBackend
+    if _jsonBackend is None:
+        names = list(JSON_BACKENDS) if JSON_BACKEND == 'auto' else [JSON_BACKEND, 'json']
+        for name in names:
+            try:
+                _jsonBackend = name, JSON_BACKENDS[name]()
+                break
+            except (ImportError, KeyError):
+                if name == JSON_BACKEND:
+                    logger.warning(f"JSON解码器{name}不可用，使用标准库json")
+        logger.debug("JSON backend: %s", _jsonBackend[0])
+    return _jsonBackend
+
+
+def jsonLoads(content):
+    return jsonBackend()[1](content)
+
+
+# 名单中取值重复度高的字段（各级组织名称和id），保存时只保留一份字符串
+INTERNED_FIELDS = frozenset(['lev1', 'lev2', 'lev3', 'lev4', 'subOrg', 'nid', 'nid1', 'nid2', 'nid3',
+                             'areaid1', 'areaid2', 'areaid3', 'areaid4', 'areaid5'])
+
+
+def _internColumn(values):
+    intern = sys.intern
+    return [intern(value) if value.__class__ is str else value for value in values]
+
+
+# 名单的列式存储：每个字段一个列表，比逐行的dict节省大部分内存，
+# 生成DataFrame时按列直接构建，不再逐行转换；遍历时仍按行返回dict，兼容原有的逐行处理
+class MemberTable:
+    __slots__ = ('columns', 'length')
+
+    def __init__(self, columns=None, length=0):
+        self.columns = columns if columns is not None else {}
+        self.length = length
+
+    @classmethod
+    def fromRows(cls, rows, fields=None):
+        if fields is None:
+            fields = list(dict.fromkeys(chain.from_iterable(rows)))
+        columns = {}
+        for field in fields:
+            column = [row.get(field) for row in rows]
+            columns[field] = _internColumn(column) if field in INTERNED_FIELDS else column
+        return cls(columns, len(rows))
+
+    @classmethod
+    def concat(cls, tables):
+        tables = [table for table in tables if len(table)]
+        if len(tables) == 1:
+            return tables[0]
+        fields = list(dict.fromkeys(chain.from_iterable(table.columns for table in tables)))
+        columns = {field: [] for field in fields}
+        for table in tables:
+            for field in fields:
+                columns[field].extend(table.columns.get(field) or [None] * len(table))
+        return cls(columns, sum(len(table) for table in tables))
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        names = list(self.columns)
+        for values in zip(*self.columns.values()):
+            yield dict(zip(names, values))
+
+    def column(self, name):
+        return self.columns.get(name) or [None] * self.length
+
+    # 按行号取出部分行
+    def take(self, indexes):
+        return MemberTable({name: [column[i] for i in indexes] for name, column in self.columns.items()},
+                           len(indexes))
+
+    def frame(self):
+        import pandas as pd
+        return pd.DataFrame(self.columns, columns=list(self.columns))
+
+
+# 名单或名单页转换为DataFrame
+def toFrame(data):
+    import pandas as pd
+    return data.frame() if isinstance(data, MemberTable) else pd.DataFrame(data)
+
+
+# 名单页解码器：名单行转换为MemberTable。指定fields时只保留导出需要的字段，
+# 使用msgspec时直接按字段定义解码，跳过其余字段；其他解码器先完整解码再挑选字段
+class RowDecoder:
+    def __init__(self, fields=None):
+        self.fields = list(fields) if fields is not None else None
+        self._typed = None
+
+    def _typedDecoder(self):
+        if self._typed is None:
+            import msgspec
+            row = msgspec.defstruct('Row', [(field, object, None) for field in self.fields])
+            page = msgspec.defstruct('Page', [('page', dict), ('data', list[row])])
+            envelope = msgspec.defstruct('Envelope', [('code', object, None), ('msg', object, None),
+                                                      ('data', page, None)])
+            self._typed = msgspec, msgspec.json.Decoder(envelope)
+        return self._typed
+
+    def _decodeTyped(self, content):
+        msgspec, decoder = self._typedDecoder()
+        try:
+            envelope = decoder.decode(content)
+        except msgspec.ValidationError:
+            # 出错时的响应不符合分页结构，按普通JSON解码
+            return None
+        except msgspec.DecodeError as e:
+            # 不是合法的JSON（例如网关错误页面），与其他解码器一样抛出ValueError
+            raise ValueError(str(e)) from e
+        if envelope.data is None:
+            return {'code': envelope.code, 'msg': envelope.msg, 'data': None}
+        rows = envelope.data.data
+        columns = {}
+        for field in self.fields:
+            column = [getattr(row, field) for row in rows]
+            columns[field] = _internColumn(column) if field in INTERNED_FIELDS else column
+        return {'code': envelope.code, 'msg': envelope.msg,
+                'data': {'page': envelope.data.page, 'data': MemberTable(columns, len(rows))}}
+
+    def __call__(self, content):
+        name, loads = jsonBackend()
+        if name == 'msgspec' and self.fields is not None:
+            response_json = self._decodeTyped(content)
+            if response_json is not None:
+                return response_json
+        response_json = loads(content)
+        data = response_json.get('data')
+        if isinstance(data, dict) and isinstance(data.get('data'), list):
+            data['data'] = MemberTable.fromRows(data['data'], self.fields)
+        return response_json
+
+
+# 发送一次请求并对结果分类，失败时抛出RetryableError或FatalError
+def sendOnce(client, method, url, headers, data, cookies, token, decoder=None):
+    import requests
+    try:
+        response = client.request(method, url, headers, data, cookies, token)
+    except (requests.ConnectionError, requests.Timeout) as e:
+        raise RetryableError(f"Network error: {e}") from e
+    except requests.RequestException as e:
+        raise FatalError(f"Request error: {e}") from e
+
+    # 检查HTTP响应码
+    if response.status_code in RETRYABLE_STATUS:
+        raise RetryableError(f"HTTP error: {response.status_code}",
+                             parseRetryAfter(response.headers.get('Retry-After')))
+    if response.status_code != 200:
+        raise FatalError(f"HTTP error: {response.status_code}")
+
+    logResponse(url, response)
+    try:
+        with METRICS.timer('json decode'):
+            response_json = (decoder or jsonLoads)(response.content)
+    except ValueError as e:
+        # 服务器过载时常返回网关错误页面而不是JSON
+        raise RetryableError(f"Invalid JSON response: {e}") from e
+
+    # 检查业务逻辑的响应码
+    if response_json.get('code') != 200:
+        raise ApiError(response_json.get('code'), response_json.get('msg'))
+    return response_json, response
 
-            logging.debug(f"Response: {response.text}")
-            response_json = response.json()
 
-            # 检查业务逻辑的响应码
-            if response_json.get('code') != 200:
-                raise Exception(f"API error: {response_json.get('msg')}")
+# 自定义请求
+def doRequest(method, url, headers=None, data=None, cookies=None, max_retries=None, needCookie=False, token=None,
+              policy=None, decoder=None):
+    logger.debug("Requesting %s %s", method, url)
+    client = getClient()
+    policy = policy or RETRY_POLICY
+    max_retries = max_retries or policy.maxAttempts
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            response_json, response = sendOnce(client, method, url, headers, data, cookies, token, decoder)
             if needCookie:
                 return response_json, response.cookies
             else:
                 return response_json  # 如果一切正常，返回响应的JSON数据
-
-        except Exception as e:
-            retries += 1
-            logging.error(f"Error: {e}. Retrying {retries}/{max_retries}...")
-
-    # 如果重试次数达到上限，抛出异常
-    logging.error("Maximum retries reached, operation failed")
-    raise Exception("Maximum retries reached, operation failed")
+        except FatalError as e:
+            logger.error(f"Error: {e}. Not retrying")
+            raise
+        except RetryableError as e:
+            if attempt >= max_retries:
+                # 如果重试次数达到上限，抛出异常
+                logger.error("Maximum retries reached, operation failed")
+                raise RetryableError("Maximum retries reached, operation failed") from e
+            if not policy.consume():
+                logger.error("Retry budget exhausted, operation failed")
+                raise RetryableError("Retry budget exhausted, operation failed") from e
+            wait = policy.delay(attempt, e.retryAfter)
+            METRICS.add('retries')
+            logger.warning("Error: %s. Retrying %d/%d in %.2fs...", e, attempt, max_retries - 1, wait)
+            time.sleep(wait)
+
+
+# 本地接口响应缓存：按接口和参数缓存到磁盘，支持有效期和LRU淘汰
+class ResponseCache:
+    def __init__(self, filename=CACHE_FILE, maxEntries=CACHE_MAX_ENTRIES):
+        self.filename = filename
+        self.maxEntries = maxEntries
+        self.entries = None
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    # 首次使用时才从磁盘加载
+    def _load(self):
+        if self.entries is not None:
+            return
+        self.entries = OrderedDict()
+        if self.filename and os.path.exists(self.filename):
+            try:
+                with open(self.filename, 'rb') as file:
+                    self.entries = pickle.load(file)
+            except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+                logger.warning("缓存文件损坏，已忽略")
+
+    def _save(self):
+        if not self.filename:
+            return
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'wb') as file:
+            pickle.dump(self.entries, file)
+        os.replace(tmp, self.filename)
+
+    @staticmethod
+    def key(*parts):
+        raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            self._load()
+            entry = self.entries.get(key)
+            if entry is None or (entry['expires'] is not None and entry['expires'] < time.time()):
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry['value']
+
+    # ttl为None表示永不过期
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._load()
+            self.entries[key] = {
+                'value': value,
+                'expires': None if ttl is None else time.time() + ttl
+            }
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxEntries:
+                self.entries.popitem(last=False)
+            self._save()
+
+    def clear(self):
+        with self._lock:
+            self.entries = OrderedDict()
+            self._save()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries or ())}
+
+
+# 全局共享的接口响应缓存
+RESPONSE_CACHE = ResponseCache()
+
+# 各期大学习的结束时间，由getClass填充，用于判断某一期是否已经结束
+_classEndTimes = {}
+
+
+# 某一期数据的缓存有效期：已结束的期数数据不会再变化，永久缓存
+def classCacheTtl(classid):
+    endTime = _classEndTimes.get(str(classid))
+    if endTime and datetime.strptime(endTime, '%Y-%m-%d %H:%M:%S') < datetime.now():
+        return None
+    return CACHE_TTL
+
+
+# 带缓存的请求，缓存按账号、接口和参数区分，refresh为True时忽略已有缓存重新请求
+def cachedRequest(method, url, data=None, cookies=None, token=None, ttl=CACHE_TTL, cache=None, refresh=False):
+    cache = cache or RESPONSE_CACHE
+    client = getClient()
+    key = cache.key(client.account or token, method, url, data)
+    response_json = None if refresh else cache.get(key)
+    if response_json is None:
+        response_json = doRequest(method, url, data=data, cookies=cookies, token=token)
+        cache.set(key, response_json, ttl)
+    return response_json
 
 
 # 登录
+@timed('api login')
 def login(account, password):
-    logging.info("account:" + account + "正在登录")
-    url = "https://hm.jxqingtuan.cn/api-org/user/login"
+    logger.info("account:" + account + "正在登录")
+    url = API_BASE + "user/login"
 
     payload = json.dumps({
         "account": account,
         "password": password
     })
-    headers = {
-        'content-type': 'application/json',
-    }
-    response_json, cookies = doRequest('post', url, headers, payload, needCookie=True)
-    logging.debug(response_json)
-    if response_json['code'] != 200:
-        logging.error("登录失败:" + response_json['msg'])
-        exit(response_json['code'])
+    try:
+        response_json, cookies = doRequest('post', url, data=payload, needCookie=True)
+    except ApiError as e:
+        logger.error("登录失败:" + str(e.msg))
+        exit(e.code)
     token = response_json['data']['token']
     userName = response_json['data']['user']['userName']
-    logging.info("登录成功:" + userName)
-    logging.debug(cookies)
-    # 保存cookies到.ptk文件
-    with open('cookies.ptk', 'wb') as file:
-        pickle.dump(cookies, file)
+    logger.info("登录成功:" + userName)
+    logger.debug("Cookies: %s", list(cookies.keys()))
+    # 之后的请求默认携带登录凭据
+    getClient().setAuth(token, cookies, account)
+    # 保存登录状态到.ptk文件，下次启动时复用
+    save_session(SESSION_FILE, account, cookies, token)
 
     return cookies, token
 
 
-# 获取未完成列表
-def getUserNotFinishRecording(cookies, classid, token, parentId=None, pageSize=1000):
-    url = "https://hm.jxqingtuan.cn/api-org/record/getUserNotFinishRecording"
-    all_data = []  # 用于存储所有页面的数据
-
-    # 先请求一次获取总页数
+# 生成名单接口的请求参数
+def recordingPayload(classid, parentId=None):
+    payload = {"classId": classid}
     if parentId:
-        payload = json.dumps({
-            "classId": classid,
-            "pageSize": pageSize,
-            "currentPage": 1,
-            "parentId": parentId
-        })
-    else:
-        payload = json.dumps({
-            "classId": classid,
-            "pageSize": pageSize,
-            "currentPage": 1
-        })
-    headers = {
-        'content-type': 'application/json',
-        'Authorization': token,
-    }
-
-    response_json = doRequest('post', url, headers, payload, cookies)
-
-    totalPages = response_json['data']['page']['totalPages']
+        payload["parentId"] = parentId
+    return payload
+
+
+# 精简解码时名单保留的字段，按原始响应中的顺序
+# 各级组织id用于建立组织索引
+FINISH_ROW_FIELDS = ['lev1', 'lev2', 'lev3', 'lev4', 'userid', 'nid', 'nid1', 'nid2', 'nid3', 'addTime', 'username']
+NOT_FINISH_ROW_FIELDS = ['userid', 'username', 'areaid1', 'areaid2', 'areaid3', 'areaid4', 'areaid5']
+FINISH_ROW_DECODER = RowDecoder(FINISH_ROW_FIELDS)
+NOT_FINISH_ROW_DECODER = RowDecoder(NOT_FINISH_ROW_FIELDS)
+ROW_DECODER = RowDecoder()
+
+
+# 分页大小自动调优：记录各接口在不同分页大小下的单页延迟和响应大小，
+# 选择在当前并发数下每秒获取行数最多的分页大小，测量数据保存到文件供之后的运行使用
+class PageSizeTuner:
+    def __init__(self, filename=TUNING_FILE, candidates=PAGE_SIZE_CANDIDATES, timeout=REQUEST_TIMEOUT):
+        self.filename = filename
+        self.candidates = sorted(candidates)
+        self.timeout = timeout
+        self.data = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self.data is not None:
+            return
+        self.data = {}
+        if self.filename and os.path.exists(self.filename):
+            try:
+                with open(self.filename, 'r', encoding='utf-8') as file:
+                    self.data = json.load(file)
+            except (OSError, ValueError):
+                logger.warning("分页大小测量数据损坏，已忽略")
+
+    def save(self):
+        with self._lock:
+            if not self.filename or self.data is None:
+                return
+            tmp = self.filename + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as file:
+                json.dump(self.data, file, indent=2)
+            os.replace(tmp, self.filename)
+
+    def _endpoint(self, endpoint):
+        self._load()
+        return self.data.setdefault(endpoint, {'sizes': {}, 'total': None, 'cap': None})
+
+    # 记录一页的延迟（秒）、行数和响应字节数，使用指数加权平均
+    def observe(self, endpoint, pageSize, latency, rows, nbytes):
+        with self._lock:
+            sizes = self._endpoint(endpoint)['sizes']
+            stat = sizes.get(str(pageSize))
+            if stat is None:
+                sizes[str(pageSize)] = {'latency': latency, 'rows': rows, 'bytes': nbytes, 'samples': 1}
+                return
+            for name, value in (('latency', latency), ('rows', rows), ('bytes', nbytes)):
+                stat[name] = stat[name] * 0.7 + value * 0.3
+            stat['samples'] += 1
+
+    # 记录一次完整获取的总行数，用于估计之后的分页数
+    def observeTotal(self, endpoint, total):
+        with self._lock:
+            self._endpoint(endpoint)['total'] = total
+
+    # 服务器实际允许的最大分页大小
+    def setCap(self, endpoint, cap):
+        with self._lock:
+            self._endpoint(endpoint)['cap'] = cap
+
+    # 估计以pageSize分页、workers并发获取total行时每秒获取的行数
+    @staticmethod
+    def throughput(stat, pageSize, total, workers):
+        pages = max(1, -(-total // pageSize))
+        # 第一页单独获取，其余页并发获取
+        elapsed = stat['latency'] * (1 + -(-(pages - 1) // workers))
+        return total / elapsed if elapsed else 0
+
+    def choose(self, endpoint, workers=MAX_WORKERS):
+        with self._lock:
+            info = self._endpoint(endpoint)
+            cap = info['cap']
+            # 服务器限制了分页大小时，上限本身也是候选值（通常就是最优值）
+            sizes = sorted({size for size in self.candidates if not cap or size <= cap} | ({cap} if cap else set()))
+            measured = {int(size): stat for size, stat in info['sizes'].items() if int(size) in sizes}
+            if not measured:
+                return 1000 if 1000 in sizes else sizes[len(sizes) // 2]
+            total = info['total'] or max(measured) * workers
+            # 单页延迟接近超时时间的分页大小容易超时，不予考虑
+            viable = [size for size, stat in measured.items() if stat['latency'] < self.timeout / 2] or [min(measured)]
+            best = max(viable, key=lambda size: self.throughput(measured[size], size, total, workers))
+            # 爬山探索：与最优值相邻的候选值还没有测量过时先尝试一次
+            index = sizes.index(best)
+            for neighbor in (index + 1, index - 1):
+                if 0 <= neighbor < len(sizes) and sizes[neighbor] not in measured:
+                    if neighbor < index or measured[best]['latency'] < self.timeout / 4:
+                        return sizes[neighbor]
+            return best
+
+
+# 全局共享的分页大小调优器
+PAGE_SIZE_TUNER = PageSizeTuner()
+
+
+# 分页获取数据的生成器：复用第一页的响应读取总页数，其余页并发预取，按页码顺序逐页返回
+# pageSize为auto时根据历史测量自动选择分页大小，并记录本次的测量结果
+def iterPages(url, payload, cookies, token, pageSize=None, workers=MAX_WORKERS, desc="Fetching pages", decoder=None):
+    pageSize = pageSize or PAGE_SIZE
+    endpoint = urlparse(url).path
+    tuner = None
+    if pageSize == 'auto':
+        tuner = PAGE_SIZE_TUNER
+        pageSize = tuner.choose(endpoint, workers)
+        logger.debug("Auto page size for %s: %s", endpoint, pageSize)
+
+    def fetchPage(page):
+        body = dict(payload, pageSize=pageSize, currentPage=page)
+        data = doRequest('post', url, data=json.dumps(body), cookies=cookies, token=token, decoder=decoder)['data']
+        if tuner:
+            last = getClient().last
+            tuner.observe(endpoint, pageSize, last.latency, len(data['data']), getattr(last, 'bytes', 0))
+        return data
+
+    started = time.perf_counter()
+    first = fetchPage(1)
+    totalPages = first['page']['totalPages']
+    if totalPages > 1 and 0 < len(first['data']) < pageSize:
+        # 服务器限制了分页大小，按实际返回的行数继续分页，避免漏掉数据
+        logger.warning(f"{endpoint} 每页最多返回{len(first['data'])}行，分页大小调整为该值")
+        pageSize = len(first['data'])
+        if tuner:
+            tuner.setCap(endpoint, pageSize)
+    totalRows = len(first['data'])
 
     # 使用tqdm创建进度条
-    for page in tqdm(range(1, totalPages + 1), desc="Fetching pages"):
-        if parentId:
-            payload = json.dumps({
-                "classId": classid,
-                "pageSize": pageSize,
-                "currentPage": page,
-                "parentId": parentId
-            })
-        else:
-            payload = json.dumps({
-                "classId": classid,
-                "pageSize": pageSize,
-                "currentPage": page
-            })
+    from tqdm import tqdm
+    with tqdm(total=max(totalPages, 1), desc=desc) as bar:
+        bar.update(1)
+        METRICS.add('rows fetched', len(first['data']))
+        yield first['data']
+        if totalPages <= 1:
+            METRICS.record('pagination ' + endpoint, time.perf_counter() - started)
+            if tuner:
+                tuner.observeTotal(endpoint, totalRows)
+                tuner.save()
+            return
 
-        response_json = doRequest('post', url, headers, payload, cookies)
+        workers = max(1, min(workers, totalPages - 1))
+        executor = ThreadPoolExecutor(max_workers=workers)
+        try:
+            # 最多预取两倍并发数的页，消费者处理较慢时内存占用也有上限
+            pending = deque()
+            nextPage = 2
+            while nextPage <= totalPages and len(pending) < workers * 2:
+                pending.append(executor.submit(fetchPage, nextPage))
+                nextPage += 1
+            while pending:
+                data = pending.popleft().result()['data']
+                if nextPage <= totalPages:
+                    pending.append(executor.submit(fetchPage, nextPage))
+                    nextPage += 1
+                totalRows += len(data)
+                bar.update(1)
+                METRICS.add('rows fetched', len(data))
+                yield data
+            METRICS.record('pagination ' + endpoint, time.perf_counter() - started)
+            if tuner:
+                tuner.observeTotal(endpoint, totalRows)
+        finally:
+            # 任意一页失败或提前停止时取消尚未开始的请求
+            executor.shutdown(wait=True, cancel_futures=True)
+            if tuner:
+                tuner.save()
+
+
+# 逐页获取未完成列表
+def iterUserNotFinishRecording(cookies, classid, token, parentId=None, pageSize=None, workers=MAX_WORKERS):
+    url = API_BASE + "record/getUserNotFinishRecording"
+    return iterPages(url, recordingPayload(classid, parentId), cookies, token, pageSize, workers,
+                     decoder=NOT_FINISH_ROW_DECODER if COMPACT_ROWS else ROW_DECODER)
+
+
+# 逐页获取完成列表
+def iterUserFinishRecording(cookies, classid, token, parentId=None, pageSize=None, workers=MAX_WORKERS):
+    url = API_BASE + "record/getUserClassRecord"
+    return iterPages(url, recordingPayload(classid, parentId), cookies, token, pageSize, workers,
+                     decoder=FINISH_ROW_DECODER if COMPACT_ROWS else ROW_DECODER)
 
-        # 添加当前页面的数据
-        data = response_json['data']['data']
-        all_data.extend(data)
 
-    return all_data
+# 获取未完成列表
+@timed('api getUserNotFinishRecording')
+def getUserNotFinishRecording(cookies, classid, token, parentId=None, pageSize=None, workers=MAX_WORKERS):
+    return MemberTable.concat(iterUserNotFinishRecording(cookies, classid, token, parentId, pageSize, workers))
 
 
 # 获取完成列表
-def getUserFinishRecording(cookies, classid, token, parentId=None, pageSize=1000):
-    url = "https://hm.jxqingtuan.cn/api-org/record/getUserClassRecord"
-    all_data = []  # 用于存储所有页面的数据
-
-    if parentId:
-        payload = json.dumps({
-            "classId": classid,
-            "pageSize": pageSize,
-            "currentPage": 1,
-            "parentId": parentId
-        })
-    else:
-        payload = json.dumps({
-            "classId": classid,
-            "pageSize": pageSize,
-            "currentPage": 1
-        })
-    headers = {
-        'content-type': 'application/json',
-        'Authorization': token,
-    }
-    response_json = doRequest('post', url, headers, payload, cookies)
-
-    totalPages = response_json['data']['page']['totalPages']
-
-    # 使用tqdm创建进度条
-    for page in tqdm(range(1, totalPages + 1), desc="Fetching pages"):
-        if parentId:
-            payload = json.dumps({
-                "classId": classid,
-                "pageSize": pageSize,
-                "currentPage": page,
-                "parentId": parentId
-            })
-        else:
-            payload = json.dumps({
-                "classId": classid,
-                "pageSize": pageSize,
-                "currentPage": page
-            })
-
-        response_json = doRequest('post', url, headers, payload, cookies)
-
-        # 添加当前页面的数据
-        data = response_json['data']['data']
-        all_data.extend(data)
-
-    return all_data
+@timed('api getUserFinishRecording')
+def getUserFinishRecording(cookies, classid, token, parentId=None, pageSize=None, workers=MAX_WORKERS):
+    return MemberTable.concat(iterUserFinishRecording(cookies, classid, token, parentId, pageSize, workers))
 
 
 # 获取组织人数信息
+@timed('api getNumInfo')
 def getNumInfo(cookies, token, printInfo=False):
-    url = "https://hm.jxqingtuan.cn/api-org/org/getMyOrgNum"
+    url = API_BASE + "org/getMyOrgNum"
 
     payload = {}
-    headers = {
-        'Authorization': token,
-        'content-type': 'application/json',
-    }
 
-    response_json = doRequest('get', url, headers, payload, cookies)
+    response_json = doRequest('get', url, data=payload, cookies=cookies, token=token)
     if printInfo:
         print("团员数:", response_json['data']['members'])
         print("团干数:", response_json['data']['cadre'])
@@ -206,16 +1039,13 @@ def getNumInfo(cookies, token, printInfo=False):
 
 
 # 获取组织详细信息
+@timed('api getOrgInfo')
 def getOrgInfo(cookies, token, printInfo=False):
-    url = "https://hm.jxqingtuan.cn/api-org/org/getMyOrgInfo"
+    url = API_BASE + "org/getMyOrgInfo"
 
     payload = {}
-    headers = {
-        'Authorization': token,
-        'content-type': 'application/json',
-    }
 
-    response_json = doRequest('get', url, headers, payload, cookies)
+    response_json = doRequest('get', url, data=payload, cookies=cookies, token=token)
     if printInfo:
         print("上级组织名称:", response_json['data']['parentIdName'])
         print("组织名称:", response_json['data']['orgName'])
@@ -224,16 +1054,16 @@ def getOrgInfo(cookies, token, printInfo=False):
 
 
 # 获取大学习信息
+@timed('api getClass')
 def getClass(cookies, token, printInfo=False):
-    url = "https://hm.jxqingtuan.cn/api-org/clazz/getClass"
+    url = API_BASE + "clazz/getClass"
 
     payload = {}
-    headers = {
-        'content-type': 'application/json',
-        'Authorization': token,
-    }
 
-    response_json = doRequest('get', url, headers, payload, cookies)
+    # 新的一期随时可能发布，只做短时间缓存
+    response_json = cachedRequest('get', url, payload, cookies, token, CACHE_TTL)
+    for item in response_json['data']:
+        _classEndTimes[str(item['id'])] = item['endTime']
     # {"id":68,"title":"2024年第2期","addTime":"2024-03-26 11:00:00","thumb":"","url":"https://h5.cyol.com/special/daxuexi/gq3dj1ys8f/m.html","ext":"","startTime":"2024-03-26 11:00:00","endTime":"2024-04-02 23:59:59","score":20,"pushState":0,"retakes":1,"theme":"青春为中国式现代化挺膺担当","pictureureUrl":"https://oos-cn.ctyunapi.cn/jxgqt/uploadFolder/public/20240326/e1d434a818fb46a295ef0bdec52de634.jpg","retakesPictureUrl":"https://oos-cn.ctyunapi.cn/jxgqt/uploadFolder/public/20240326/5ac0000815ca46628c0ff4f4e9b47c95.png","videoUrl":"","videoCoverImg":"","videoEndImg":"","status":"1","duration":500,"classExamTitle":""}
     if printInfo:
         print("大学习名称:", response_json['data'][0]['title'] + ":" + response_json['data'][0]['theme'])
@@ -257,18 +1087,15 @@ def getClass(cookies, token, printInfo=False):
 
 
 # 获取组织大学习进度
+@timed('api getFullSummary')
 def getFullSummary(cookies, token, classid, printInfo=False):
-    url = "https://hm.jxqingtuan.cn/api-org/record/getOrgLowerClassRecordSummary"
+    url = API_BASE + "record/getOrgLowerClassRecordSummary"
 
     payload = {
         'classId': classid
     }
-    headers = {
-        'content-type': 'application/json',
-        'Authorization': token,
-    }
 
-    response_json = doRequest('get', url, headers, payload, cookies)
+    response_json = doRequest('get', url, data=payload, cookies=cookies, token=token)
     #  {"code":200,"msg":"请求成功","data":{"id":"68","allNum":2398,"num":2097,"title":"2024年第2期","orgName":"软件与物联网工程学院团委","occupancy":87.4500}}
     if printInfo:
         print("大学习标题:", response_json['data']['title'])
@@ -279,19 +1106,22 @@ def getFullSummary(cookies, token, classid, printInfo=False):
     return response_json
 
 
-# 获取子组织大学习进度
-def getClassSummary(cookies, token, classid):
-    url = "https://hm.jxqingtuan.cn/api-org/record/getOrgClassRecord"
+# 获取子组织大学习记录（getClassSummary和getClassId共用，结果会被缓存）
+@timed('api getOrgClassRecord')
+def getOrgClassRecord(cookies, token, classid, refresh=False):
+    url = API_BASE + "record/getOrgClassRecord"
 
     payload = json.dumps({
         "classId": classid
     })
-    headers = {
-        'content-type': 'application/json',
-        'Authorization': token
-    }
 
-    response_json = doRequest('post', url, headers, payload, cookies)
+    return cachedRequest('post', url, payload, cookies, token, classCacheTtl(classid), refresh=refresh)
+
+
+# 获取子组织大学习进度
+@timed('api getClassSummary')
+def getClassSummary(cookies, token, classid):
+    response_json = getOrgClassRecord(cookies, token, classid)
     data_array = response_json['data']
     data_dict = {}
     for item in data_array:
@@ -308,18 +1138,9 @@ def getClassSummary(cookies, token, classid):
 
 
 # 获取子组织id
+@timed('api getClassId')
 def getClassId(cookies, token, classid):
-    url = "https://hm.jxqingtuan.cn/api-org/record/getOrgClassRecord"
-
-    payload = json.dumps({
-        "classId": classid
-    })
-    headers = {
-        'content-type': 'application/json',
-        'Authorization': token
-    }
-
-    response_json = doRequest('post', url, headers, payload, cookies)
+    response_json = getOrgClassRecord(cookies, token, classid)
     data_array = response_json['data']
     data1_dict = {}
     data2_dict = {}
@@ -339,12 +1160,14 @@ def getClassId(cookies, token, classid):
 
 # 加密和解密的函数
 def encrypt_message(message, key):
+    from cryptography.fernet import Fernet
     f = Fernet(key)
     encrypted_message = f.encrypt(message.encode())
     return encrypted_message
 
 
 def decrypt_message(encrypted_message, key):
+    from cryptography.fernet import Fernet
     f = Fernet(key)
     decrypted_message = f.decrypt(encrypted_message).decode()
     return decrypted_message
@@ -366,8 +1189,826 @@ def load_credentials(filename, key):
     return account, password
 
 
+# 保存和加载登录状态的函数
+def save_session(filename, account, cookies, token, ttl=SESSION_TTL):
+    session = {
+        'account': account,
+        'token': token,
+        'cookies': cookies,
+        'expires': time.time() + ttl
+    }
+    with open(filename, 'wb') as file:
+        pickle.dump(session, file)
+
+
+def load_session(filename, account):
+    if not os.path.exists(filename):
+        return None
+    try:
+        with open(filename, 'rb') as file:
+            session = pickle.load(file)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        return None
+    # 旧版本只保存了cookies，或者账号不同、已过期时都视为无效
+    if not isinstance(session, dict) or session.get('account') != account:
+        return None
+    if session.get('expires', 0) < time.time():
+        return None
+    return session['cookies'], session['token']
+
+
+# 优先复用缓存的登录状态，只有在失效时才重新登录
+def restoreLogin(account, password, filename=SESSION_FILE):
+    session = load_session(filename, account)
+    if session:
+        cookies, token = session
+        try:
+            # 用一个轻量的接口校验token是否仍然有效
+            getNumInfo(cookies, token)
+            getClient().setAuth(token, cookies, account)
+            logger.info("使用缓存的登录状态:" + account)
+            return cookies, token
+        except RequestError as e:
+            logger.info(f"缓存的登录状态已失效（{e}），重新登录")
+    return login(account, password)
+
+
+# 完成名单中需要隐藏的列
+FINISH_HIDDEN_COLUMNS = ['id', 'classId', 'score', 'lev1', 'lev2', 'lev3', 'lev4', 'userid', 'nid', 'subOrg',
+                         'nid1', 'nid2', 'nid3', 'status', 'studyTime']
+
+
+# 各类导出的列重命名
+FINISH_RENAMES = {'addTime': '学习时间', 'username': '姓名'}
+NOT_FINISH_RENAMES = {'username': '姓名'}
+SUMMARY_RENAMES = {
+    'allNum': '总人数',
+    'num': '已学习人数',
+    'orgName': '团支部',
+    'occupancy': '学习率'
+}
+
+
+# 导出格式定义：文件（工作表）标题、隐藏的列、只显示的列和列重命名，单独的文件和多工作表报告共用
+class ExportLayout:
+    def __init__(self, title, hiddenColumns=(), visibleColumns=None, renames=None):
+        self.title = title
+        self.hiddenColumns = hiddenColumns
+        self.visibleColumns = visibleColumns
+        self.renames = renames or {}
+
+    def open(self, filename):
+        return openStreamWriter(filename, self.hiddenColumns, self.visibleColumns, self.renames)
+
+    # 只保留不隐藏的列，用于不支持隐藏列的展示方式
+    def view(self, df):
+        return df[[col for col in df.columns if col not in self.hiddenColumns
+                   and (self.visibleColumns is None or col in self.visibleColumns)]]
+
+
+EXPORT_LAYOUTS = {
+    'finish': ExportLayout('完成名单', FINISH_HIDDEN_COLUMNS, renames=FINISH_RENAMES),
+    # 未完成名单只显示团支部（如有）和姓名
+    'unfinish': ExportLayout('未完成名单', visibleColumns=['团支部', '姓名'], renames=NOT_FINISH_RENAMES),
+    'summary': ExportLayout('各团支部完成情况统计', ['id'], renames=SUMMARY_RENAMES),
+    'newlyFinished': ExportLayout('新完成名单', ['userid'], renames={'username': '姓名'}),
+    'progress': ExportLayout('完成进度时间序列', ['id'], renames={'polledAt': '时间', **SUMMARY_RENAMES}),
+}
+
+
+# 导出文件名：fileTitle-期数名称-当前时间.扩展名
+def exportFilename(fileTitle, classTitle, fmt='xlsx'):
+    # 多个导出任务可能同时创建
+    os.makedirs(output, exist_ok=True)
+    return f'./{output}/{fileTitle}-{classTitle}-{datetime.now().strftime("%Y%m%d%H%M%S")}.{EXPORTERS[fmt].ext}'
+
+
+# 组织路径由这几级组织名称拼接而成
+ORG_PATH_COLUMNS = ['lev1', 'lev2', 'lev3', 'lev4']
+# 成员所属各级组织id所在的列，按从上到下的顺序
+AREA_ID_COLUMNS = [f'areaid{i}' for i in range(1, 6)]
+# 完成名单和未完成名单中从上到下各级组织id所在的列
+ORG_ID_COLUMNS = {'finish': ['nid1', 'nid2', 'nid3', 'nid'], 'unfinish': AREA_ID_COLUMNS}
+# 名单类型
+ROSTER_KINDS = ('finish', 'unfinish')
+
+
+# 按areaid1..5的顺序查找第一个属于id2name_dict的组织，返回团支部名称列，找不到时为空字符串
+def mapBranch(df, id2name_dict, columns=AREA_ID_COLUMNS):
+    import pandas as pd
+    branch = pd.Series(pd.NA, index=df.index, dtype=object)
+    for col in columns:
+        if col in df.columns:
+            branch = branch.fillna(df[col].map(id2name_dict))
+    return branch.fillna("")
+
+
+# 用“-”拼接各级组织名称
+def joinOrgPath(df, columns=ORG_PATH_COLUMNS):
+    first, rest = columns[0], columns[1:]
+    return df[first].str.cat([df[col] for col in rest], sep='-', na_rep='')
+
+
+# 生成完成名单的DataFrame
+@timed('transform finishFrame')
+def finishFrame(data):
+    import pandas as pd
+    df = toFrame(data)
+    if df.empty:
+        return pd.DataFrame(columns=['学习时间', '姓名', '组织'])
+    df['组织'] = joinOrgPath(df, ORG_PATH_COLUMNS)
+    df.rename(columns=FINISH_RENAMES, inplace=True)
+    return df
+
+
+# 生成未完成名单的DataFrame，传入id2name_dict时生成团支部列
+@timed('transform notFinishFrame')
+def notFinishFrame(data, id2name_dict=None):
+    import pandas as pd
+    df = toFrame(data)
+    if df.empty:
+        return pd.DataFrame(columns=['团支部', '姓名'] if id2name_dict is not None else ['姓名'])
+
+    if id2name_dict is not None:
+        # 生成团支部列
+        df['团支部'] = mapBranch(df, id2name_dict)
+
+    # 重命名username列为姓名
+    df.rename(columns=NOT_FINISH_RENAMES, inplace=True)
+    return df
+
+
+# 生成各团支部完成情况统计的DataFrame
+@timed('transform summaryFrame')
+def summaryFrame(data):
+    import pandas as pd
+    df = pd.DataFrame(data)
+    # 重命名列
+    df = df.rename(columns=SUMMARY_RENAMES)
+    # 重新排序列
+    df = df.reindex(columns=['id', '团支部', '已学习人数', '总人数', '学习率'])
+    # 根据团支部排序
+    return df.sort_values(by='团支部')
+
+
+# 组织树的一个节点，num和allNum为该组织及全部下级组织的已学习人数和总人数
+class OrgNode:
+    __slots__ = ('id', 'name', 'parent', 'children', 'num', 'allNum')
+
+    def __init__(self, orgId, name=None, parent=None):
+        self.id = orgId
+        self.name = name
+        self.parent = parent
+        self.children = []
+        self.num = 0
+        self.allNum = 0
+
+    @property
+    def occupancy(self):
+        return round(self.num * 100 / self.allNum, 4) if self.allNum else 0
+
+    # 与getOrgClassRecord返回的团支部统计格式相同
+    def summary(self):
+        return {'id': self.id, 'orgName': self.name, 'allNum': self.allNum, 'num': self.num,
+                'occupancy': self.occupancy}
+
+
+# 组织索引：由一次完整获取的完成和（或）未完成名单，按成员所属的各级组织id建立组织树，
+# 可以按id或名称O(1)查找任意组织，直接得到各级组织的统计和名单，不再需要按团支部逐个请求接口。
+# 只包含一类名单时，各组织的人数统计也只包含这一类名单中的成员
+class OrgIndex:
+    # 各级组织id所在的列，以及完成名单中对应的组织名称所在的列
+    PATH_COLUMNS = ORG_ID_COLUMNS
+    NAME_COLUMNS = {'finish': ORG_PATH_COLUMNS, 'unfinish': []}
+
+    def __init__(self, branches=()):
+        self.nodes = {}
+        self.byName = {}
+        self.roots = []
+        # 团支部（getOrgClassRecord返回的下级组织）
+        self.branches = [self.node(item['id'], item['orgName']) for item in branches]
+        self.rosters = {}
+        # 组织id -> 该组织下成员在名单中的行号
+        self.members = {}
+        self.builtAt = time.time()
+
+    # rosters为名单类型 -> 完整名单
+    @classmethod
+    def build(cls, branches, rosters):
+        index = cls(branches)
+        for kind, table in rosters.items():
+            index.addRoster(kind, table)
+        return index
+
+    # 是否包含所需的全部名单类型
+    def covers(self, kinds):
+        return all(kind in self.rosters for kind in kinds)
+
+    # 组织id统一为字符串：接口可能返回数字id，而URL等处查找时使用字符串
+    def node(self, orgId, name=None, parent=None):
+        orgId = str(orgId)
+        node = self.nodes.get(orgId)
+        if node is None:
+            node = self.nodes[orgId] = OrgNode(orgId)
+        if name and not node.name:
+            node.name = name
+            self.byName.setdefault(name, node)
+        if parent is not None and node.parent is None and node not in self.roots:
+            node.parent = parent
+            parent.children.append(node)
+        return node
+
+    # 组织路径：跳过空的和与上一级重复的id，名称只用于补全还没有名称的组织
+    def _path(self, ids, names):
+        path = []
+        parent = None
+        for level, orgId in enumerate(ids):
+            if not orgId or (parent is not None and str(orgId) == parent.id):
+                continue
+            node = self.node(orgId, names[level] if level < len(names) else None, parent)
+            if parent is None and node.parent is None and node not in self.roots:
+                self.roots.append(node)
+            path.append(node)
+            parent = node
+        return path
+
+    def addRoster(self, kind, table):
+        self.rosters[kind] = table
+        members = self.members.setdefault(kind, defaultdict(list))
+        idColumns = [table.column(column) for column in self.PATH_COLUMNS[kind]]
+        nameColumns = [table.column(column) for column in self.NAME_COLUMNS[kind]]
+        # 同一团支部的成员路径相同，每条路径只解析一次，人数最后一次性累加到路径上的各级组织
+        paths = {}
+        counts = defaultdict(int)
+        for i, ids in enumerate(zip(*idColumns)):
+            path = paths.get(ids)
+            if path is None:
+                path = paths[ids] = self._path(ids, [column[i] for column in nameColumns])
+            counts[ids] += 1
+            for node in path:
+                members[node.id].append(i)
+        for ids, n in counts.items():
+            for node in paths[ids]:
+                node.allNum += n
+                if kind == 'finish':
+                    node.num += n
+
+    def get(self, orgId):
+        return self.nodes.get(str(orgId))
+
+    def find(self, name):
+        return self.byName.get(name)
+
+    def summary(self, orgId):
+        node = self.nodes.get(str(orgId))
+        return node.summary() if node else None
+
+    # 各团支部的统计，与getOrgClassRecord的返回格式相同
+    def branchSummaries(self):
+        return [node.summary() for node in self.branches]
+
+    # 某个组织下的完成或未完成名单
+    def roster(self, orgId, kind):
+        table = self.rosters.get(kind, MemberTable())
+        return table.take(self.members.get(kind, {}).get(str(orgId), []))
+
+
+# 组织索引的缓存：同一期的索引在缓存有效期内复用，已结束的期数一直复用
+_orgIndexes = {}
+_orgIndexLock = threading.Lock()
+
+
+# 已建立、仍在有效期内且包含所需名单类型的组织索引，没有时返回None
+def cachedOrgIndex(classid, kinds=ROSTER_KINDS):
+    with _orgIndexLock:
+        index = _orgIndexes.get(classid)
+    ttl = classCacheTtl(classid)
+    if index is not None and index.covers(kinds) and (ttl is None or time.time() - index.builtAt < ttl):
+        return index
+    return None
+
+
+# 获取某一期的组织索引：团支部统计和所需类型的完整名单并发获取，不需要的名单不获取
+def getOrgIndex(cookies, token, classid, kinds=ROSTER_KINDS, refresh=False):
+    index = None if refresh else cachedOrgIndex(classid, kinds)
+    if index is not None:
+        return index
+    fetchers = {'finish': getUserFinishRecording, 'unfinish': getUserNotFinishRecording}
+    with ThreadPoolExecutor(max_workers=1 + len(kinds)) as executor:
+        branches = executor.submit(getOrgClassRecord, cookies, token, classid)
+        rosters = {kind: executor.submit(fetchers[kind], cookies, classid, token) for kind in kinds}
+        with METRICS.timer('transform orgIndex'):
+            index = OrgIndex.build(branches.result()['data'],
+                                   {kind: future.result() for kind, future in rosters.items()})
+    # 两类名单都有时各团支部的人数应与接口统计一致
+    if index.covers(ROSTER_KINDS):
+        for item in branches.result()['data']:
+            node = index.get(item['id'])
+            if (node.num, node.allNum) != (item['num'], item['allNum']):
+                logger.debug("%s 名单人数%s/%s与接口统计%s/%s不一致", item['orgName'], node.num, node.allNum,
+                             item['num'], item['allNum'])
+    with _orgIndexLock:
+        _orgIndexes[classid] = index
+    return index
+
+
+# 流式写入器：逐块写入DataFrame，列在写入第一块时确定，内存占用与总行数无关
+class StreamWriter:
+    # 文件扩展名
+    ext = None
+    # 除pandas外需要安装的模块
+    requires = ()
+
+    # 所需模块是否已安装，只查找不导入
+    @classmethod
+    def available(cls):
+        return all(importlib.util.find_spec(name) is not None for name in cls.requires)
+
+    def __init__(self, filename, hiddenColumns=(), visibleColumns=None, renames=None):
+        self.filename = filename
+        self.hiddenColumns = hiddenColumns
+        self.visibleColumns = visibleColumns
+        self.renames = renames or {}
+        self.columns = None
+        self.rows = 0
+
+    # hiddenColumns中的列、以及不在visibleColumns中的列需要隐藏
+    def isHidden(self, col):
+        if col in self.hiddenColumns:
+            return True
+        return self.visibleColumns is not None and col not in self.visibleColumns
+
+    # 导出的列信息：隐藏的列，以及重命名后的列对应的原始字段名
+    def metadata(self):
+        columns = self.columns or []
+        return {
+            'hidden': [col for col in columns if self.isHidden(col)],
+            'renames': {new: old for old, new in self.renames.items() if new in columns}
+        }
+
+    def write(self, df):
+        with METRICS.timer('write ' + self.ext):
+            if self.columns is None:
+                self.columns = list(df.columns)
+                self.open()
+            else:
+                df = df.reindex(columns=self.columns)
+            if len(df):
+                self.writeRows(df)
+                self.rows += len(df)
+        METRICS.add('rows written', len(df))
+
+    def close(self):
+        with METRICS.timer('write ' + self.ext):
+            if self.columns is None:
+                self.columns = []
+                self.open()
+            self.finish()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def open(self):
+        raise NotImplementedError
+
+    def writeRows(self, df):
+        raise NotImplementedError
+
+    def finish(self):
+        raise NotImplementedError
+
+
+# xlsx写入器：使用xlsxwriter的constant_memory模式逐行写入，隐藏的列不设置宽度和格式
+class XlsxStreamWriter(StreamWriter):
+    ext = 'xlsx'
+    requires = ('xlsxwriter',)
+    # 由XlsxWorkbook设置时写入共用Workbook中的一个工作表，关闭时不关闭Workbook
+    workbook = None
+    sheetName = 'Sheet1'
+
+    def open(self):
+        import xlsxwriter
+        self.ownsWorkbook = self.workbook is None
+        if self.ownsWorkbook:
+            self.workbook = xlsxwriter.Workbook(self.filename, {'constant_memory': True})
+        self.worksheet = self.workbook.add_worksheet(self.sheetName)
+        # 与pandas.to_excel的表头样式一致
+        headerFormat = self.workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+        for idx, col in enumerate(self.columns):
+            if self.isHidden(col):
+                self.worksheet.set_column(idx, idx, None, None, {'hidden': True})
+        self.worksheet.write_row(0, 0, self.columns, headerFormat)
+        self.nextRow = 1
+
+    def writeRows(self, df):
+        # 空值写为空单元格
+        values = df.astype(object).where(df.notna(), None)
+        for row in values.itertuples(index=False, name=None):
+            self.worksheet.write_row(self.nextRow, 0, row)
+            self.nextRow += 1
+
+    def finish(self):
+        if self.ownsWorkbook:
+            self.workbook.close()
+
+
+# 多工作表的xlsx文件：各工作表依次写入，共用一个constant_memory模式的Workbook
+class XlsxWorkbook:
+    def __init__(self, filename):
+        import xlsxwriter
+        self.filename = filename
+        self.workbook = xlsxwriter.Workbook(filename, {'constant_memory': True})
+        self.sheetNames = set()
+
+    # 工作表名称最多31个字符且不能包含[]:*?/\，重名时加序号
+    def uniqueName(self, name):
+        name = re.sub(r'[\[\]:*?/\\]', '', name)[:31] or 'Sheet'
+        candidate, n = name, 1
+        while candidate.lower() in self.sheetNames:
+            n += 1
+            suffix = f'({n})'
+            candidate = name[:31 - len(suffix)] + suffix
+        self.sheetNames.add(candidate.lower())
+        return candidate
+
+    def sheet(self, name, layout):
+        writer = XlsxStreamWriter(self.filename, layout.hiddenColumns, layout.visibleColumns, layout.renames)
+        writer.workbook = self.workbook
+        writer.sheetName = self.uniqueName(name)
+        return writer
+
+    def close(self):
+        with METRICS.timer('write xlsx'):
+            self.workbook.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+# csv写入器：带BOM以便Excel正确识别中文，列信息写入同名的.meta.json文件
+class CsvStreamWriter(StreamWriter):
+    ext = 'csv'
+
+    def open(self):
+        import pandas as pd
+        self.file = open(self.filename, 'w', encoding='utf-8-sig', newline='')
+        pd.DataFrame(columns=self.columns).to_csv(self.file, index=False)
+
+    def writeRows(self, df):
+        df.to_csv(self.file, header=False, index=False)
+
+    def finish(self):
+        self.file.close()
+        with open(self.filename + '.meta.json', 'w', encoding='utf-8') as file:
+            json.dump(self.metadata(), file, ensure_ascii=False, indent=2)
+
+
+# Arrow格式写入器的公共部分：由第一块推断schema，列信息写入schema的metadata，需要安装pyarrow
+class ArrowStreamWriter(StreamWriter):
+    requires = ('pyarrow',)
+
+    def open(self):
+        try:
+            import pyarrow
+        except ImportError:
+            raise RuntimeError(f"导出{self.ext}格式需要安装pyarrow")
+        self.pa = pyarrow
+        self.writer = None
+        self.schema = None
+
+    def buildSchema(self, df=None):
+        pa = self.pa
+        if df is None:
+            schema = pa.schema([(col, pa.string()) for col in self.columns])
+        else:
+            schema = pa.Schema.from_pandas(df, preserve_index=False)
+            # 第一块中全为空的列无法推断类型，按字符串处理
+            for i, field in enumerate(schema):
+                if pa.types.is_null(field.type):
+                    schema = schema.set(i, field.with_type(pa.string()))
+        metadata = dict(schema.metadata or {})
+        metadata[b'jysc'] = json.dumps(self.metadata(), ensure_ascii=False).encode()
+        return schema.with_metadata(metadata)
+
+    def writeRows(self, df):
+        if self.writer is None:
+            self.schema = self.buildSchema(df)
+            self.writer = self.newWriter(self.schema)
+        self.writer.write_table(self.pa.Table.from_pandas(df, schema=self.schema, preserve_index=False))
+
+    def finish(self):
+        if self.writer is None:
+            self.schema = self.buildSchema()
+            self.writer = self.newWriter(self.schema)
+        self.writer.close()
+
+    def newWriter(self, schema):
+        raise NotImplementedError
+
+
+# parquet写入器：每一块写为一个row group
+class ParquetStreamWriter(ArrowStreamWriter):
+    ext = 'parquet'
+
+    def newWriter(self, schema):
+        import pyarrow.parquet as pq
+        return pq.ParquetWriter(self.filename, schema)
+
+
+# feather写入器：即Arrow IPC文件格式，每一块写为一个record batch
+class FeatherStreamWriter(ArrowStreamWriter):
+    ext = 'feather'
+
+    def newWriter(self, schema):
+        try:
+            options = self.pa.ipc.IpcWriteOptions(compression='lz4')
+        except (ValueError, NotImplementedError, self.pa.ArrowException):
+            options = None
+        return self.pa.ipc.new_file(self.filename, schema, options=options)
+
+
+# 导出格式注册表：格式名 -> 写入器
+EXPORTERS = {}
+
+
+def registerExporter(name, writerClass):
+    EXPORTERS[name] = writerClass
+
+
+registerExporter('xlsx', XlsxStreamWriter)
+registerExporter('csv', CsvStreamWriter)
+registerExporter('parquet', ParquetStreamWriter)
+registerExporter('feather', FeatherStreamWriter)
+
+
+# 依赖已安装、可以使用的导出格式
+def availableExporters():
+    return [name for name, writerClass in EXPORTERS.items() if writerClass.available()]
+
+
+# 按文件扩展名选择写入器
+def openStreamWriter(filename, hiddenColumns=(), visibleColumns=None, renames=None):
+    ext = os.path.splitext(filename)[1].lower().lstrip('.')
+    for writerClass in EXPORTERS.values():
+        if writerClass.ext == ext:
+            return writerClass(filename, hiddenColumns, visibleColumns, renames)
+    raise ValueError("Unsupported export format: " + ext)
+
+
+# 导出完成名单，pages为逐页的名单数据，每页转换后立即写入
+def exportFinish(pages, filename):
+    with EXPORT_LAYOUTS['finish'].open(filename) as writer:
+        for data in pages:
+            writer.write(finishFrame(data))
+    return filename
+
+
+# 导出未完成名单，只显示团支部（如有）和姓名
+def exportNotFinish(pages, filename, id2name_dict=None):
+    with EXPORT_LAYOUTS['unfinish'].open(filename) as writer:
+        for data in pages:
+            writer.write(notFinishFrame(data, id2name_dict))
+    return filename
+
+
+# 导出各团支部完成情况统计，隐藏id列
+def exportSummary(data, filename):
+    with EXPORT_LAYOUTS['summary'].open(filename) as writer:
+        writer.write(summaryFrame(data))
+    return filename
+
+
+# 名单按团支部拆分：整个名单只转换一次，再按成员所属的团支部做一次groupby，
+# 返回与branches顺序对应的(团支部, DataFrame)，没有成员的团支部为空表
+@timed('transform partitionRoster')
+def partitionRoster(kind, table, branches):
+    frame = finishFrame(table) if kind == 'finish' else notFinishFrame(table)
+    key = mapBranch(frame, {branch['id']: branch['id'] for branch in branches}, ORG_ID_COLUMNS[kind])
+    groups = dict(iter(frame.groupby(key, sort=False)))
+    empty = frame.iloc[:0]
+    return [(branch, groups.get(branch['id'], empty)) for branch in branches]
+
+
+# 在子进程中写入一个已转换好的名单
+def writeFrame(kind, df, filename):
+    with EXPORT_LAYOUTS[kind].open(filename) as writer:
+        writer.write(df)
+    return filename
+
+
+# 团支部汇总报告：一个xlsx文件，第一个工作表为各团支部统计，之后每个团支部的每类名单一个工作表。
+# 完整名单只获取一次（来自组织索引），转换和拆分各一次，全部工作表依次写入
+def exportWorkbook(cookies, token, classId, classTitle, branches, kinds=ROSTER_KINDS):
+    kinds = [kind for kind in kinds if kind in ROSTER_KINDS]
+    index = getOrgIndex(cookies, token, classId, kinds)
+    partitions = {kind: partitionRoster(kind, index.rosters[kind], branches) for kind in kinds}
+    filename = exportFilename('团支部汇总报告', classTitle, 'xlsx')
+    with XlsxWorkbook(filename) as workbook:
+        layout = EXPORT_LAYOUTS['summary']
+        with workbook.sheet(layout.title, layout) as writer:
+            writer.write(summaryFrame(branches))
+        for i, branch in enumerate(branches):
+            for kind in kinds:
+                layout = EXPORT_LAYOUTS[kind]
+                with workbook.sheet(branch['orgName'] + layout.title, layout) as writer:
+                    writer.write(partitions[kind][i][1])
+    return filename
+
+
+# 名单中成员的唯一标识
+def memberKey(row):
+    key = row.get('userid') or row.get('id')
+    if key is None:
+        key = row.get('username', '')
+    return str(key)
+
+
+# 名单内容的摘要，用于判断导出文件是否需要重写
+def rowsDigest(rows, *extra):
+    if isinstance(rows, MemberTable):
+        rows = rows.columns
+    raw = json.dumps([rows, *extra], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+# 名单快照库：按期数和成员记录每次获取到的完成状态，用于计算两次运行之间新完成的成员，
+# 并记录导出文件的内容摘要，内容未变化时跳过重写
+class SnapshotStore:
+    def __init__(self, filename=SNAPSHOT_FILE):
+        self.filename = filename
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self.conn:
+            self.conn.executescript('''
+                CREATE TABLE IF NOT EXISTS members (
+                    classId TEXT NOT NULL,
+                    userid TEXT NOT NULL,
+                    username TEXT,
+                    scope TEXT NOT NULL DEFAULT '',
+                    finished INTEGER NOT NULL,
+                    firstSeen REAL NOT NULL,
+                    changedAt REAL,
+                    updatedAt REAL NOT NULL,
+                    PRIMARY KEY (classId, userid)
+                );
+                CREATE TABLE IF NOT EXISTS fetches (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    classId TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    scope TEXT NOT NULL,
+                    rows INTEGER NOT NULL,
+                    fetchedAt REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS exports (
+                    key TEXT PRIMARY KEY,
+                    digest TEXT NOT NULL,
+                    filename TEXT NOT NULL,
+                    exportedAt REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS progress (
+                    classId TEXT NOT NULL,
+                    orgId TEXT NOT NULL,
+                    orgName TEXT,
+                    num INTEGER NOT NULL,
+                    allNum INTEGER NOT NULL,
+                    polledAt REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS progressByOrg ON progress (classId, orgId, polledAt);
+            ''')
+
+    # 写入一次获取到的名单，scope为团支部id，整个组织为空字符串
+    def _record(self, classId, kind, rows, scope, finished, now):
+        classId = str(classId)
+        values = [(classId, memberKey(row), row.get('username'), scope, finished, now, now) for row in rows]
+        self.conn.executemany('''
+            INSERT INTO members (classId, userid, username, scope, finished, firstSeen, updatedAt)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (classId, userid) DO UPDATE SET
+                username = excluded.username,
+                scope = CASE WHEN excluded.scope = '' THEN members.scope ELSE excluded.scope END,
+                changedAt = CASE WHEN members.finished != excluded.finished THEN excluded.updatedAt
+                                 ELSE members.changedAt END,
+                finished = excluded.finished,
+                updatedAt = excluded.updatedAt
+        ''', values)
+        self.conn.execute('INSERT INTO fetches (classId, kind, scope, rows, fetchedAt) VALUES (?, ?, ?, ?, ?)',
+                          (classId, kind, scope, len(rows), now))
+
+    def recordFinished(self, classId, rows, scope='', now=None):
+        now = now or time.time()
+        with self._lock, self.conn:
+            self._record(classId, 'finish', rows, scope, 1, now)
+
+    # 写入未完成名单：上次未完成、这次不在名单中的成员视为已完成
+    def recordNotFinished(self, classId, rows, scope='', now=None):
+        now = now or time.time()
+        with self._lock, self.conn:
+            self._record(classId, 'unfinish', rows, scope, 0, now)
+            sql = '''
+                UPDATE members SET finished = 1, changedAt = ?, updatedAt = ?
+                WHERE classId = ? AND finished = 0 AND updatedAt < ?
+            '''
+            params = [now, now, str(classId), now]
+            if scope:
+                sql += ' AND scope = ?'
+                params.append(scope)
+            self.conn.execute(sql, params)
+
+    # since之后由未完成变为完成的成员
+    def newlyFinished(self, classId, since):
+        with self._lock:
+            cursor = self.conn.execute('''
+                SELECT userid, username, changedAt FROM members
+                WHERE classId = ? AND finished = 1 AND changedAt >= ?
+                ORDER BY changedAt, userid
+            ''', (str(classId), since))
+            return [{'userid': userid, 'username': username, 'changedAt': changedAt}
+                    for userid, username, changedAt in cursor.fetchall()]
+
+    # 内容摘要与上次导出相同且文件仍存在时，返回上次导出的文件名
+    def unchangedExport(self, key, digest):
+        with self._lock:
+            row = self.conn.execute('SELECT digest, filename FROM exports WHERE key = ?', (key,)).fetchone()
+        if row and row[0] == digest and os.path.exists(row[1]):
+            return row[1]
+        return None
+
+    def recordExport(self, key, digest, filename):
+        with self._lock, self.conn:
+            self.conn.execute('''
+                INSERT INTO exports (key, digest, filename, exportedAt) VALUES (?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                    digest = excluded.digest, filename = excluded.filename, exportedAt = excluded.exportedAt
+            ''', (key, digest, filename, time.time()))
+
+    # 追加一次轮询得到的完成人数，items为getOrgClassRecord格式的统计，整个组织的id为空字符串
+    def recordProgress(self, classId, items, now=None):
+        now = now or time.time()
+        values = [(str(classId), str(item['id']), item.get('orgName'), item['num'], item['allNum'], now)
+                  for item in items]
+        with self._lock, self.conn:
+            self.conn.executemany('''
+                INSERT INTO progress (classId, orgId, orgName, num, allNum, polledAt) VALUES (?, ?, ?, ?, ?, ?)
+            ''', values)
+
+    # 各组织最近一次记录的(完成人数, 总人数)
+    def latestProgress(self, classId):
+        with self._lock:
+            cursor = self.conn.execute('''
+                SELECT orgId, num, allNum FROM progress p
+                WHERE classId = ? AND polledAt = (
+                    SELECT MAX(polledAt) FROM progress WHERE classId = p.classId AND orgId = p.orgId
+                )
+            ''', (str(classId),))
+            return {orgId: (num, allNum) for orgId, num, allNum in cursor.fetchall()}
+
+    # 某一期的完成进度时间序列，只在人数变化时有记录
+    def progress(self, classId):
+        with self._lock:
+            cursor = self.conn.execute('''
+                SELECT orgId, orgName, num, allNum, polledAt FROM progress
+                WHERE classId = ? ORDER BY polledAt, orgId
+            ''', (str(classId),))
+            return [{'id': orgId, 'orgName': orgName, 'num': num, 'allNum': allNum, 'polledAt': polledAt}
+                    for orgId, orgName, num, allNum, polledAt in cursor.fetchall()]
+
+    def close(self):
+        self.conn.close()
+
+
+# 导出新完成名单
+def exportNewlyFinished(rows, filename):
+    import pandas as pd
+    df = pd.DataFrame(rows, columns=['userid', 'username', 'changedAt'])
+    df['changedAt'] = df['changedAt'].map(lambda t: datetime.fromtimestamp(t).strftime('%Y-%m-%d %H:%M:%S'))
+    df = df.rename(columns={'username': '姓名', 'changedAt': '发现完成时间'})
+    with EXPORT_LAYOUTS['newlyFinished'].open(filename) as writer:
+        writer.write(df)
+    return filename
+
+
+# 导出完成进度时间序列，每行为某个组织在某次轮询时的人数
+def exportProgress(rows, filename):
+    import pandas as pd
+    df = pd.DataFrame(rows, columns=['polledAt', 'id', 'orgName', 'allNum', 'num'])
+    df['polledAt'] = df['polledAt'].map(lambda t: datetime.fromtimestamp(t).strftime('%Y-%m-%d %H:%M:%S'))
+    df['occupancy'] = (df['num'] * 100 / df['allNum'].where(df['allNum'] > 0)).round(2)
+    layout = EXPORT_LAYOUTS['progress']
+    df = df.rename(columns=layout.renames)
+    with layout.open(filename) as writer:
+        writer.write(df)
+    return filename
+
+
 # 嵌套菜单的函数
 def studyMenu(cookies, token):
+    import questionary
     classInfoJson, classInfoDict = getClass(cookies, token, printInfo=False)
     classList = list(classInfoDict.keys())
     classList[0] = classList[0] + "（最近一期/当前大学习）"
@@ -375,6 +2016,7 @@ def studyMenu(cookies, token):
     classIndex = classList.index(classChoice)
     classKey = list(classInfoDict.keys())[classIndex]
     classId = classInfoDict[classKey]['id']
+    classTitle = classInfoJson['data'][classIndex]['title']
     print("大学习名称:", classInfoJson['data'][classIndex]['title'] + ":" + classInfoJson['data'][classIndex]['theme'])
     print("大学习开始时间:", classInfoJson['data'][classIndex]['startTime'])
     print("大学习结束时间:", classInfoJson['data'][classIndex]['endTime'])
@@ -387,74 +2029,23 @@ def studyMenu(cookies, token):
         '查看并导出特定子团支部完成情况名单',
         '查看并导出特定子团支部未完成情况名单',
         '查看并导出各个子团支部完成情况统计',
+        '导出全部子团支部的完成和未完成名单',
+        '导出团支部汇总报告（统计表和各团支部名单在一个xlsx文件中）',
         '返回主菜单'
     ]
     while True:
         choice = questionary.select("请选择一个需要查询的期数:", choices=choices).ask()
-        fileTitle = None
+        # 汇总报告固定为xlsx格式
+        if choice not in ('返回主菜单', '导出团支部汇总报告（统计表和各团支部名单在一个xlsx文件中）'):
+            fmt = questionary.select("请选择导出格式:", choices=availableExporters(), default='xlsx').ask()
         # 准备数据
-        if choice == '导出全部完成情况名单' or choice == '导出全部未完成情况名单':
+        if choice == '导出全部完成情况名单':
+            pages = iterUserFinishRecording(cookies, classId, token)
+            exportFinish(pages, exportFilename('完成名单', classTitle, fmt))
+        elif choice == '导出全部未完成情况名单':
             id2name_dict, _ = getClassId(cookies, token, classId)
-            if choice == '导出全部完成情况名单':
-                data = getUserFinishRecording(cookies, classId, token)
-                fileTitle = '完成名单'
-                df = pd.DataFrame(data)
-                df['组织'] = df[['lev1', 'lev2', 'lev3', 'lev4']].apply('-'.join, axis=1)
-                df.rename(columns={'addTime': '学习时间', 'username': '姓名'}, inplace=True)
-                # 定义要隐藏的列
-                columns_to_hide = ['id', 'classId', 'score', 'lev1', 'lev2', 'lev3', 'lev4', 'userid', 'nid', 'subOrg',
-                                   'nid1', 'nid2', 'nid3', 'status', 'studyTime']
-
-                # 导出DataFrame到Excel
-                filename = f'./导出/{fileTitle}-{classInfoJson["data"][classIndex]["title"]}-{pd.Timestamp.now().strftime("%Y%m%d%H%M%S")}.xlsx'
-                with pd.ExcelWriter(filename, engine='xlsxwriter') as writer:
-                    df.to_excel(writer, index=False, sheet_name='Sheet1')
-
-                    # 获取工作表
-                    worksheet = writer.sheets['Sheet1']
-
-                    # 遍历需要隐藏的列
-                    for col_name in columns_to_hide:
-                        # 获取列的索引
-                        col_idx = pd.Index(df.columns).get_loc(col_name)
-                        # 隐藏列，不设置宽度和格式
-                        worksheet.set_column(col_idx, col_idx, None, options={'hidden': True})
-            else:
-                data = getUserNotFinishRecording(cookies, classId, token)
-                fileTitle = '未完成名单'
-                # 加载数据到DataFrame
-                df = pd.DataFrame(data)
-
-                # 生成团支部列
-                def map_area(row):
-                    for i in range(1, 6):
-                        try:
-                            area_id = row[f'areaid{i}']
-                            if area_id in id2name_dict:
-                                return id2name_dict[area_id]
-                        except KeyError:
-                            continue
-                    return ""
-
-                df['团支部'] = df.apply(map_area, axis=1)
-
-                # 重命名username列为姓名
-                df.rename(columns={'username': '姓名'}, inplace=True)
-
-                # 创建一个Excel写入器
-                # 名称为 fileTitle-classInfoJson['data'][classIndex]['title']-当前时间.xlsx
-                with pd.ExcelWriter(
-                        f'./导出/{fileTitle}-{classInfoJson["data"][classIndex]["title"]}-{pd.Timestamp.now().strftime("%Y%m%d%H%M%S")}.xlsx') as writer:
-                    df.to_excel(writer, index=False)
-
-                    # 获取工作表
-                    workbook = writer.book
-                    worksheet = writer.sheets['Sheet1']
-
-                    # 设置除了团支部和姓名的所有列为隐藏
-                    for idx, col in enumerate(df.columns):
-                        if col not in ['团支部', '姓名']:
-                            worksheet.set_column(idx, idx, None, None, {'hidden': True})
+            pages = iterUserNotFinishRecording(cookies, classId, token)
+            exportNotFinish(pages, exportFilename('未完成名单', classTitle, fmt), id2name_dict)
         elif choice == '查看并导出特定子团支部完成情况名单' or choice == '查看并导出特定子团支部未完成情况名单':
             # 选择团支部
             id2name_dict, class_dict = getClassId(cookies, token, classId)
@@ -470,76 +2061,32 @@ def studyMenu(cookies, token):
             class_Index = listChoices.index(classChoice)
             class_Key = list(class_dict.keys())[class_Index]
             class_Id = class_dict[class_Key]['id']
+            # 已经获取过完整名单时直接从组织索引中取出
             if choice == '查看并导出特定子团支部完成情况名单':
-                data = getUserFinishRecording(cookies, classId, token, parentId=class_Id)
-                fileTitle = class_Key + '完成名单'
-                df = pd.DataFrame(data)
-                df['组织'] = df[['lev1', 'lev2', 'lev3', 'lev4']].apply('-'.join, axis=1)
-                df.rename(columns={'addTime': '学习时间', 'username': '姓名'}, inplace=True)
-                # 定义要隐藏的列
-                columns_to_hide = ['id', 'classId', 'score', 'lev1', 'lev2', 'lev3', 'lev4', 'userid', 'nid', 'subOrg',
-                                   'nid1', 'nid2', 'nid3', 'status', 'studyTime']
-
-                # 导出DataFrame到Excel
-                filename = f'./导出/{fileTitle}-{classInfoJson["data"][classIndex]["title"]}-{pd.Timestamp.now().strftime("%Y%m%d%H%M%S")}.xlsx'
-                with pd.ExcelWriter(filename, engine='xlsxwriter') as writer:
-                    df.to_excel(writer, index=False, sheet_name='Sheet1')
-
-                    # 获取工作表
-                    worksheet = writer.sheets['Sheet1']
-
-                    # 遍历需要隐藏的列
-                    for col_name in columns_to_hide:
-                        # 获取列的索引
-                        col_idx = pd.Index(df.columns).get_loc(col_name)
-                        # 隐藏列，不设置宽度和格式
-                        worksheet.set_column(col_idx, col_idx, None, options={'hidden': True})
+                index = cachedOrgIndex(classId, ['finish'])
+                if index is not None:
+                    pages = [index.roster(class_Id, 'finish')]
+                else:
+                    pages = iterUserFinishRecording(cookies, classId, token, parentId=class_Id)
+                exportFinish(pages, exportFilename(class_Key + '完成名单', classTitle, fmt))
             else:
-                data = getUserNotFinishRecording(cookies, classId, token, parentId=class_Id)
-                fileTitle = class_Key + '未完成名单'
-                # 加载数据到DataFrame
-                df = pd.DataFrame(data)
-
-                # 重命名username列为姓名
-                df.rename(columns={'username': '姓名'}, inplace=True)
-
-                # 创建一个Excel写入器
-                # 名称为 fileTitle-classInfoJson['data'][classIndex]['title']-当前时间.xlsx
-                with pd.ExcelWriter(
-                        f'./导出/{fileTitle}-{classInfoJson["data"][classIndex]["title"]}-{pd.Timestamp.now().strftime("%Y%m%d%H%M%S")}.xlsx') as writer:
-                    df.to_excel(writer, index=False)
-
-                    # 获取工作表
-                    workbook = writer.book
-                    worksheet = writer.sheets['Sheet1']
-
-                    # 设置除了姓名的所有列为隐藏
-                    for idx, col in enumerate(df.columns):
-                        if col not in ['姓名']:
-                            worksheet.set_column(idx, idx, None, None, {'hidden': True})
+                index = cachedOrgIndex(classId, ['unfinish'])
+                if index is not None:
+                    pages = [index.roster(class_Id, 'unfinish')]
+                else:
+                    pages = iterUserNotFinishRecording(cookies, classId, token, parentId=class_Id)
+                exportNotFinish(pages, exportFilename(class_Key + '未完成名单', classTitle, fmt))
         elif choice == '查看并导出各个子团支部完成情况统计':
-            fileTitle = "各团支部完成情况统计"
             data, _ = getClassSummary(cookies, token, classId)
-            df = pd.DataFrame(data['data'])
-            # 重命名列
-            df = df.rename(columns={
-                'allNum': '总人数',
-                'num': '已学习人数',
-                'orgName': '团支部',
-                'occupancy': '学习率'
-            })
-            # 重新排序列
-            df = df[['id', '团支部', '已学习人数', '总人数', '学习率']]
-            # 根据团支部排序
-            df = df.sort_values(by='团支部')
-            # 导出DataFrame到Excel
-            with pd.ExcelWriter(f'./导出/{fileTitle}-{classInfoJson["data"][classIndex]["title"]}-{pd.Timestamp.now().strftime("%Y%m%d%H%M%S")}.xlsx', engine='xlsxwriter') as writer:
-                df.to_excel(writer, index=False, sheet_name='Sheet1')
-                # 获取工作表
-                workbook = writer.book
-                worksheet = writer.sheets['Sheet1']
-                # 隐藏id列
-                worksheet.set_column('A:A', None, None, {'hidden': True})
+            exportSummary(data['data'], exportFilename("各团支部完成情况统计", classTitle, fmt))
+        elif choice == '导出全部子团支部的完成和未完成名单':
+            _, class_dict = getClassId(cookies, token, classId)
+            files, failures = exportBranches(cookies, token, classId, classTitle, list(class_dict.values()),
+                                             fmt=fmt)
+            print(f"已导出{len(files)}个文件，失败{len(failures)}个")
+        elif choice == '导出团支部汇总报告（统计表和各团支部名单在一个xlsx文件中）':
+            _, class_dict = getClassId(cookies, token, classId)
+            print(exportWorkbook(cookies, token, classId, classTitle, list(class_dict.values())))
         elif choice == '返回主菜单':
             return
         # 是否返回主菜单
@@ -548,22 +2095,815 @@ def studyMenu(cookies, token):
             return
 
 
-def main_menu():
-    isLogin = False
-    credentials_file = 'account.data'
+# 批量导出支持的导出类型
+EXPORT_KINDS = ['finish', 'unfinish', 'summary']
+# 批量导出时同时进行的导出任务数
+EXPORT_JOBS = 4
+# 保存的账号信息文件
+CREDENTIALS_FILE = 'account.data'
+
+
+# 生成加密账号信息使用的Fernet密钥
+def credentialKey():
     # 你的原始密钥
     password = 'JiangxiYouthStudyMaker'
     # 使用SHA-256哈希函数来生成一个固定长度的字节序列
     hash = hashlib.sha256(password.encode()).digest()
     # 将生成的哈希值转换为Base64编码以获得Fernet密钥
-    key = base64.urlsafe_b64encode(hash)
+    return base64.urlsafe_b64encode(hash)
+
+
+# 按期数参数选择需要导出的期数：latest为最近一期，all为全部，否则为逗号分隔的期数id
+def selectClasses(classInfoJson, periods='latest'):
+    items = classInfoJson['data']
+    if periods == 'latest':
+        return items[:1]
+    if periods == 'all':
+        return items
+    ids = [period.strip() for period in periods.split(',') if period.strip()]
+    selected = [item for item in items if str(item['id']) in ids]
+    missing = set(ids) - {str(item['id']) for item in selected}
+    if missing:
+        logger.warning("未找到期数: " + ",".join(sorted(missing)))
+    return selected
+
+
+# 按名称关键字选择团支部，all表示全部团支部
+def selectBranches(class_dict, filters):
+    if 'all' in filters:
+        return list(class_dict.values())
+    return [value for name, value in class_dict.items() if any(keyword in name for keyword in filters)]
+
+
+# 单个导出任务：逐页获取数据并流式写入一个文件，branch为None时导出整个组织
+def exportTask(cookies, token, kind, classId, classTitle, branch=None, id2name_dict=None, fmt='xlsx'):
+    parentId = branch['id'] if branch else None
+    prefix = branch['orgName'] if branch else ''
+    if kind == 'finish':
+        pages = iterUserFinishRecording(cookies, classId, token, parentId=parentId)
+        return exportFinish(pages, exportFilename(prefix + EXPORT_LAYOUTS[kind].title, classTitle, fmt))
+    elif kind == 'unfinish':
+        pages = iterUserNotFinishRecording(cookies, classId, token, parentId=parentId)
+        return exportNotFinish(pages, exportFilename(prefix + EXPORT_LAYOUTS[kind].title, classTitle, fmt),
+                               None if branch else id2name_dict)
+    elif kind == 'summary':
+        data, _ = getClassSummary(cookies, token, classId)
+        return exportSummary(data['data'], exportFilename(EXPORT_LAYOUTS[kind].title, classTitle, fmt))
+    raise ValueError("Unsupported export kind: " + kind)
+
+
+# 增量导出任务：名单写入快照库，内容与上次导出相同时跳过重写
+def incrementalExportTask(cookies, token, kind, classId, classTitle, branch=None, id2name_dict=None, fmt='xlsx',
+                          store=None, now=None):
+    if kind not in ('finish', 'unfinish'):
+        return exportTask(cookies, token, kind, classId, classTitle, branch, id2name_dict, fmt)
+    parentId = branch['id'] if branch else None
+    prefix = branch['orgName'] if branch else ''
+    scope = str(parentId or '')
+    if kind == 'finish':
+        rows = getUserFinishRecording(cookies, classId, token, parentId=parentId)
+        store.recordFinished(classId, rows, scope, now)
+        digest = rowsDigest(rows)
+    else:
+        rows = getUserNotFinishRecording(cookies, classId, token, parentId=parentId)
+        store.recordNotFinished(classId, rows, scope, now)
+        id2name_dict = None if branch else id2name_dict
+        digest = rowsDigest(rows, sorted((id2name_dict or {}).items()))
+
+    key = f'{classId}/{kind}/{scope}/{fmt}'
+    previous = store.unchangedExport(key, digest)
+    if previous:
+        logger.info(f"名单未变化，跳过导出: {previous}")
+        return previous
+    if kind == 'finish':
+        filename = exportFinish([rows], exportFilename(prefix + EXPORT_LAYOUTS[kind].title, classTitle, fmt))
+    else:
+        filename = exportNotFinish([rows], exportFilename(prefix + EXPORT_LAYOUTS[kind].title, classTitle, fmt),
+                                   id2name_dict)
+    store.recordExport(key, digest, filename)
+    return filename
+
+
+# 在子进程中写入一个团支部的名单文件
+def writeRoster(kind, rows, filename):
+    if kind == 'finish':
+        return exportFinish([rows], filename)
+    return exportNotFinish([rows], filename)
+
+
+# 获取一个团支部的名单
+def fetchBranchRoster(cookies, token, kind, classId, branch):
+    if kind == 'finish':
+        return getUserFinishRecording(cookies, classId, token, parentId=branch['id'])
+    return getUserNotFinishRecording(cookies, classId, token, parentId=branch['id'])
+
+
+# 所选团支部需要获取的名单行数达到完整名单行数的这一比例时，一次获取完整名单建立组织索引，不再按团支部逐个请求
+ORG_INDEX_MIN_SHARE = 0.5
+
+
+# 按团支部统计估算的名单行数：完成名单为已学习人数，未完成名单为其余人数
+def rosterRows(items, kinds):
+    rows = 0
+    for item in items:
+        if 'finish' in kinds:
+            rows += item['num']
+        if 'unfinish' in kinds:
+            rows += item['allNum'] - item['num']
+    return rows
+
+
+# 一次获取完整名单是否比按团支部逐个获取更划算：只比较所需类型的名单行数
+def preferOrgIndex(branches, allBranches, kinds):
+    return rosterRows(branches, kinds) >= rosterRows(allBranches, kinds) * ORG_INDEX_MIN_SHARE
+
+
+# 按团支部导出时是否使用组织索引：已有包含所需名单的索引时直接使用，否则所选团支部的名单行数较多时建立索引
+def branchOrgIndex(cookies, token, classId, branches, kinds=ROSTER_KINDS):
+    index = cachedOrgIndex(classId, kinds)
+    if index is not None:
+        return index
+    if preferOrgIndex(branches, getOrgClassRecord(cookies, token, classId)['data'], kinds):
+        return getOrgIndex(cookies, token, classId, kinds)
+    return None
+
+
+# 并发导出多个团支部的名单：团支部较多时把完整名单一次拆分，否则在线程池中逐个获取，
+# xlsx等文件在进程池中生成以利用全部CPU核心
+def exportBranches(cookies, token, classId, classTitle, branches, kinds=ROSTER_KINDS, fmt='xlsx',
+                   jobs=EXPORT_JOBS, processes=None):
+    kinds = [kind for kind in kinds if kind in ROSTER_KINDS]
+    files = []
+    failures = []
+    try:
+        index = branchOrgIndex(cookies, token, classId, branches, kinds)
+    except Exception as e:
+        logger.error(f"获取失败 {classTitle} 完整名单: {e}")
+        return files, [(classTitle, branch['orgName'], kind) for branch in branches for kind in kinds]
+    # 使用spawn启动子进程，避免fork时复制线程池和连接池的状态
+    context = multiprocessing.get_context('spawn')
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as fetchPool, \
+            ProcessPoolExecutor(max_workers=processes, mp_context=context) as writePool:
+        writes = []
+        if index is not None:
+            # 完整名单按团支部一次拆分，各团支部的文件在进程池中并行写入
+            for kind in kinds:
+                for branch, df in partitionRoster(kind, index.rosters[kind], branches):
+                    filename = exportFilename(branch['orgName'] + EXPORT_LAYOUTS[kind].title, classTitle, fmt)
+                    writes.append((writePool.submit(writeFrame, kind, df, filename), kind, branch))
+        else:
+            fetches = {}
+            for branch in branches:
+                for kind in kinds:
+                    future = fetchPool.submit(fetchBranchRoster, cookies, token, kind, classId, branch)
+                    fetches[future] = (kind, branch)
+
+            # 先获取完的团支部先开始写文件
+            for future in as_completed(fetches):
+                kind, branch = fetches[future]
+                try:
+                    rows = future.result()
+                except Exception as e:
+                    logger.error(f"获取失败 {classTitle} {branch['orgName']} {kind}: {e}")
+                    failures.append((classTitle, branch['orgName'], kind))
+                    continue
+                filename = exportFilename(branch['orgName'] + EXPORT_LAYOUTS[kind].title, classTitle, fmt)
+                writes.append((writePool.submit(writeRoster, kind, rows, filename), kind, branch))
+
+        for future, kind, branch in writes:
+            try:
+                files.append(future.result())
+            except Exception as e:
+                logger.error(f"导出失败 {classTitle} {branch['orgName']} {kind}: {e}")
+                failures.append((classTitle, branch['orgName'], kind))
+    return files, failures
+
+
+# 非交互式批量导出：一次运行并发导出所选期数、导出类型和团支部的全部文件
+# 传入store时为增量导出，并额外导出自上次运行以来新完成的成员名单
+def batchExport(cookies, token, periods='latest', kinds=EXPORT_KINDS, branches=None, jobs=EXPORT_JOBS,
+                fmt='xlsx', store=None, processes=None, workbook=False):
+    if workbook and (not branches or store is not None):
+        raise ValueError("团支部汇总报告需要指定团支部，且不支持增量导出")
+    now = time.time()
+    classInfoJson, _ = getClass(cookies, token)
+    classes = selectClasses(classInfoJson, periods)
+    files = []
+    failures = []
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        # 并发获取各期的团支部信息
+        classIds = list(executor.map(lambda item: getClassId(cookies, token, item['id']), classes))
+        tasks = []
+        fanOuts = []
+        for item, (id2name_dict, class_dict) in zip(classes, classIds):
+            if branches:
+                # 统计表按期数导出一份即可，名单按团支部分别导出
+                # 汇总报告中已包含统计表
+                targets = [(kind, None) for kind in kinds if kind == 'summary' and not workbook]
+                selected = selectBranches(class_dict, branches)
+                if store is None:
+                    fanOuts.append((item, selected))
+                else:
+                    targets += [(kind, branch) for branch in selected for kind in kinds if kind != 'summary']
+            else:
+                targets = [(kind, None) for kind in kinds]
+            for kind, branch in targets:
+                if store is None:
+                    future = executor.submit(exportTask, cookies, token, kind, item['id'], item['title'], branch,
+                                             id2name_dict, fmt)
+                else:
+                    future = executor.submit(incrementalExportTask, cookies, token, kind, item['id'], item['title'],
+                                             branch, id2name_dict, fmt, store, now)
+                tasks.append((future, kind, item['title'], branch['orgName'] if branch else ''))
+
+        for future, kind, classTitle, branchName in tasks:
+            try:
+                files.append(future.result())
+            except Exception as e:
+                logger.error(f"导出失败 {classTitle} {branchName} {kind}: {e}")
+                failures.append((classTitle, branchName, kind))
+
+    # 各团支部的名单在独立的线程池和进程池中并发导出，或写入一个汇总报告
+    for item, selected in fanOuts:
+        if workbook:
+            try:
+                files.append(exportWorkbook(cookies, token, item['id'], item['title'], selected, kinds))
+            except Exception as e:
+                logger.error(f"导出失败 {item['title']} 团支部汇总报告: {e}")
+                failures.append((item['title'], '', 'workbook'))
+            continue
+        branchFiles, branchFailures = exportBranches(cookies, token, item['id'], item['title'], selected, kinds, fmt,
+                                                     jobs, processes)
+        files += branchFiles
+        failures += branchFailures
+
+    if store is not None:
+        for item in classes:
+            newly = store.newlyFinished(item['id'], now)
+            logger.info(f"{item['title']} 自上次运行以来新完成{len(newly)}人")
+            if newly:
+                files.append(exportNewlyFinished(newly, exportFilename(EXPORT_LAYOUTS['newlyFinished'].title,
+                                                                       item['title'], fmt)))
+    return files, failures
+
+
+# 趋势分析默认包含的最近期数
+TREND_PERIODS = 10
+# 完成率（%）低于该值的期数计为落后
+TREND_THRESHOLD = 80.0
+
+
+# 选择趋势分析的期数：periods为数字时取最近的N期，否则与批量导出的--period相同
+def selectTrendClasses(classInfoJson, periods=TREND_PERIODS):
+    if str(periods).isdigit():
+        return classInfoJson['data'][:int(periods)]
+    return selectClasses(classInfoJson, periods)
+
+
+# 并发获取多期的各团支部统计，已结束的期数使用缓存
+def fetchTrendSummaries(cookies, token, classes, jobs=EXPORT_JOBS):
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        return list(executor.map(lambda item: getOrgClassRecord(cookies, token, item['id'])['data'], classes))
+
+
+# 团支部×期数的完成率矩阵，期数按从早到晚排列，团支部名称取最近一期的名称
+def trendMatrix(classes, summaries):
+    import pandas as pd
+    frames = []
+    for item, data in zip(classes, summaries):
+        df = pd.DataFrame(data, columns=['id', 'orgName', 'allNum', 'num'])
+        df['period'] = item['title']
+        frames.append(df)
+    periods = [item['title'] for item in reversed(classes)]
+    if not frames:
+        return pd.DataFrame(columns=['id', '团支部'])
+    history = pd.concat(frames, ignore_index=True)
+    history['rate'] = (history['num'] / history['allNum'].where(history['allNum'] > 0) * 100).round(2)
+    matrix = history.pivot_table(index='id', columns='period', values='rate', aggfunc='first', dropna=False)
+    matrix = matrix.reindex(columns=periods)
+    matrix.columns.name = None
+    names = history.drop_duplicates('id').set_index('id')['orgName']
+    matrix.insert(0, '团支部', names.reindex(matrix.index))
+    return matrix.reset_index().sort_values('团支部', ignore_index=True)
+
+
+# 长期落后的团支部排名：落后期数达到minPeriods的团支部，按落后期数、最近连续落后期数和平均完成率排序
+def rankLaggards(matrix, threshold=TREND_THRESHOLD, minPeriods=None):
+    import pandas as pd
+    rates = matrix.drop(columns=['id', '团支部'])
+    if minPeriods is None:
+        minPeriods = max(1, (rates.shape[1] + 1) // 2)
+    below = rates.lt(threshold)
+    report = pd.DataFrame({
+        'id': matrix['id'],
+        '团支部': matrix['团支部'],
+        '统计期数': rates.notna().sum(axis=1),
+        '落后期数': below.sum(axis=1),
+        # 从最近一期往前连续落后的期数
+        '连续落后期数': below.iloc[:, ::-1].cumprod(axis=1).sum(axis=1),
+        '平均完成率': rates.mean(axis=1).round(2),
+        '最近一期完成率': rates.iloc[:, -1] if rates.shape[1] else pd.NA,
+    })
+    report = report[report['落后期数'] >= minPeriods]
+    report = report.sort_values(['落后期数', '连续落后期数', '平均完成率'], ascending=[False, False, True],
+                                ignore_index=True)
+    report.insert(0, '排名', range(1, len(report) + 1))
+    return report
+
+
+# 导出趋势报告：完成率矩阵和长期落后团支部排名各一个文件
+def exportTrend(matrix, laggards, classTitle, fmt='xlsx'):
+    files = []
+    for fileTitle, df in (('团支部完成率趋势', matrix), ('长期落后团支部排名', laggards)):
+        filename = exportFilename(fileTitle, classTitle, fmt)
+        with openStreamWriter(filename, hiddenColumns=['id']) as writer:
+            writer.write(df)
+        files.append(filename)
+    return files
+
+
+# 多期趋势分析：获取所选期数的各团支部统计，导出完成率矩阵和长期落后团支部排名
+def trendReport(cookies, token, periods=TREND_PERIODS, threshold=TREND_THRESHOLD, minPeriods=None, jobs=EXPORT_JOBS,
+                fmt='xlsx'):
+    classInfoJson, _ = getClass(cookies, token)
+    classes = selectTrendClasses(classInfoJson, periods)
+    if not classes:
+        raise ValueError("没有可分析的期数")
+    summaries = fetchTrendSummaries(cookies, token, classes, jobs)
+    with METRICS.timer('transform trendMatrix'):
+        matrix = trendMatrix(classes, summaries)
+        laggards = rankLaggards(matrix, threshold, minPeriods)
+    classTitle = classes[-1]['title'] + '至' + classes[0]['title'] if len(classes) > 1 else classes[0]['title']
+    logger.info(f"{classTitle} 共{len(matrix)}个团支部，长期落后{len(laggards)}个")
+    return exportTrend(matrix, laggards, classTitle, fmt)
+
+
+# 监视模式默认的轮询间隔（秒）
+WATCH_INTERVAL = 10 * 60
+# 监视模式默认拉取的名单类型
+WATCH_KINDS = ['unfinish']
+
+
+# 与上次记录相比(完成人数, 总人数)有变化的组织
+def changedProgress(items, previous):
+    return [item for item in items if previous.get(str(item['id'])) != (item['num'], item['allNum'])]
+
+
+# 获取有变化的团支部的名单：这些团支部的名单行数较多时一次获取所需类型的完整名单建立组织索引，否则逐个获取
+def fetchChangedRosters(cookies, token, classId, branches, allBranches, kinds, jobs=EXPORT_JOBS):
+    if preferOrgIndex(branches, allBranches, kinds):
+        index = getOrgIndex(cookies, token, classId, kinds, refresh=True)
+        return [(kind, branch, index.roster(branch['id'], kind)) for branch in branches for kind in kinds]
+    targets = [(kind, branch) for branch in branches for kind in kinds]
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        rosters = executor.map(lambda target: fetchBranchRoster(cookies, token, target[0], classId, target[1]),
+                               targets)
+        return [(kind, branch, rows) for (kind, branch), rows in zip(targets, rosters)]
+
+
+# 一次轮询：先只获取整个组织的完成人数，有变化时才获取各团支部统计，
+# 只拉取人数有变化的团支部的名单，写入快照库并导出。名单全部拉取成功后才记录进度，
+# 失败的团支部在下次轮询时仍会被视为有变化
+def watchOnce(cookies, token, store, kinds=WATCH_KINDS, fmt='xlsx', jobs=EXPORT_JOBS, now=None):
+    now = now or time.time()
+    classInfoJson, _ = getClass(cookies, token)
+    current = classInfoJson['data'][0]
+    classId = current['id']
+    previous = store.latestProgress(classId)
+    full = getFullSummary(cookies, token, classId)['data']
+    total = {'id': '', 'orgName': full.get('orgName'), 'num': full['num'], 'allNum': full['allNum']}
+    if not changedProgress([total], previous):
+        logger.info(f"{current['title']} 已完成{full['num']}/{full['allNum']}，没有变化")
+        return current, []
+
+    branches = getOrgClassRecord(cookies, token, classId, refresh=True)['data']
+    changed = changedProgress(branches, previous)
+    files = []
+    for kind, branch, rows in fetchChangedRosters(cookies, token, classId, changed, branches, kinds, jobs):
+        if kind == 'finish':
+            store.recordFinished(classId, rows, str(branch['id']), now)
+        else:
+            store.recordNotFinished(classId, rows, str(branch['id']), now)
+        filename = exportFilename(branch['orgName'] + EXPORT_LAYOUTS[kind].title, current['title'], fmt)
+        files.append(writeRoster(kind, rows, filename))
+    store.recordProgress(classId, [total] + changed, now)
+    logger.info(f"{current['title']} 已完成{full['num']}/{full['allNum']}，{len(changed)}个团支部人数变化，"
+                f"新完成{len(store.newlyFinished(classId, now))}人")
+    return current, files
+
+
+# 监视模式：按固定间隔轮询当前一期，每次轮询的请求数只与人数有变化的团支部数量有关。
+# 运行count次后（0为一直运行）或按Ctrl+C停止，停止时导出各期的完成进度时间序列
+def watch(cookies, token, store, interval=WATCH_INTERVAL, count=0, kinds=WATCH_KINDS, fmt='xlsx', jobs=EXPORT_JOBS,
+          relogin=None):
+    classes = {}
+    files = []
+    polls = 0
+    try:
+        while True:
+            started = time.monotonic()
+            polls += 1
+            # 重试预算按每次轮询计算，长时间运行不会耗尽
+            RETRY_POLICY.reset()
+            try:
+                current, rosterFiles = watchOnce(cookies, token, store, kinds, fmt, jobs)
+                classes[current['id']] = current['title']
+                files += rosterFiles
+            except ApiError as e:
+                if e.code != 401 or relogin is None:
+                    logger.error(f"第{polls}次轮询失败: {e}")
+                else:
+                    logger.warning("登录已过期，重新登录")
+                    cookies, token = relogin()
+            except RequestError as e:
+                logger.error(f"第{polls}次轮询失败: {e}")
+            if count and polls >= count:
+                break
+            time.sleep(max(0.0, interval - (time.monotonic() - started)))
+    except KeyboardInterrupt:
+        logger.info("监视已停止")
+    for classId, classTitle in classes.items():
+        files.append(exportProgress(store.progress(classId),
+                                    exportFilename(EXPORT_LAYOUTS['progress'].title, classTitle, fmt)))
+    return files
+
+
+# 报告服务的默认刷新间隔（秒）
+REPORT_REFRESH = 5 * 60
+# 超过这一大小的响应使用gzip压缩
+REPORT_GZIP_MIN_SIZE = 1024
+
+
+# 报告服务的共享缓存：后台线程按固定间隔获取一次团支部统计和完整名单（组织索引），
+# 所有查看者的请求都只读缓存，渲染结果按刷新批次缓存，访问人数不影响上游请求数
+class ReportCache:
+    def __init__(self, cookies, token, classId=None, interval=REPORT_REFRESH, relogin=None):
+        self.cookies = cookies
+        self.token = token
+        # 为None时始终使用最近一期
+        self.classId = classId
+        self.interval = interval
+        self.relogin = relogin
+        # 一次刷新得到的(期数信息, 团支部统计, 组织索引, 刷新时间)，刷新时整体替换
+        self.snapshot = None
+        self.generation = 0
+        # 路径 -> (ETag, 内容类型, 响应体, gzip压缩后的响应体)
+        self.responses = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    @timed('report refresh')
+    def refresh(self):
+        classInfoJson, _ = getClass(self.cookies, self.token)
+        if self.classId is None:
+            current = classInfoJson['data'][0]
+        else:
+            current = next((item for item in classInfoJson['data'] if str(item['id']) == str(self.classId)), None)
+            if current is None:
+                raise ValueError(f"期数不存在: {self.classId}")
+        # 已结束的期数数据不会再变化，加载后不再刷新
+        if self.snapshot and self.snapshot[0]['id'] == current['id'] and classCacheTtl(current['id']) is None:
+            return
+        branches = getOrgClassRecord(self.cookies, self.token, current['id'], refresh=True)['data']
+        index = getOrgIndex(self.cookies, self.token, current['id'], refresh=True)
+        with self._lock:
+            self.snapshot = (current, branches, index, time.time())
+            self.generation += 1
+            self.responses = {}
+        logger.info(f"报告数据已刷新: {current['title']}，{len(branches)}个团支部")
+
+    def run(self):
+        while not self._stop.wait(self.interval):
+            # 重试预算按每次刷新计算
+            RETRY_POLICY.reset()
+            try:
+                self.refresh()
+            except ApiError as e:
+                if e.code != 401 or self.relogin is None:
+                    logger.error(f"报告数据刷新失败，继续使用上次的数据: {e}")
+                    continue
+                logger.warning("登录已过期，重新登录")
+                self.cookies, self.token = self.relogin()
+            except (RequestError, ValueError) as e:
+                logger.error(f"报告数据刷新失败，继续使用上次的数据: {e}")
+
+    # 先同步加载一次，之后在后台线程中刷新
+    def start(self):
+        self.refresh()
+        threading.Thread(target=self.run, name='report-refresh', daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    # 各路径的内容：/为期数信息和团支部列表，/summary为各团支部统计，
+    # /branches/<团支部id或名称>/finish和/unfinish为名单，扩展名.json或.csv决定格式
+    def render(self, snapshot, path):
+        current, branches, index, refreshedAt = snapshot
+        name, _, fmt = path.rpartition('.')
+        if fmt not in ('json', 'csv'):
+            name, fmt = path, 'json'
+        parts = [unquote(part) for part in name.strip('/').split('/') if part]
+        if not parts:
+            if fmt != 'json':
+                return None
+            return self.encode({
+                'classId': current['id'], 'title': current['title'],
+                'refreshedAt': datetime.fromtimestamp(refreshedAt).strftime('%Y-%m-%d %H:%M:%S'),
+                'branches': [{**item, 'finish': f"/branches/{item['id']}/finish", 'unfinish':
+                              f"/branches/{item['id']}/unfinish"} for item in branches],
+            }, fmt)
+        if parts == ['summary']:
+            if fmt == 'json':
+                return self.encode(branches, fmt)
+            return self.encode(EXPORT_LAYOUTS['summary'].view(summaryFrame(branches)), fmt)
+        if len(parts) == 3 and parts[0] == 'branches' and parts[2] in ('finish', 'unfinish'):
+            node = index.get(parts[1]) or index.find(parts[1])
+            if node is None:
+                return None
+            kind = parts[2]
+            table = index.roster(node.id, kind)
+            df = finishFrame(table) if kind == 'finish' else notFinishFrame(table)
+            return self.encode(EXPORT_LAYOUTS[kind].view(df), fmt)
+        return None
+
+    # 编码为响应体，ETag由内容计算，刷新后内容未变化的响应仍可返回304
+    @staticmethod
+    def encode(data, fmt):
+        import gzip
+        if fmt == 'csv':
+            body = data.to_csv(index=False).encode('utf-8-sig')
+            contentType = 'text/csv; charset=utf-8'
+        else:
+            if hasattr(data, 'to_json'):
+                body = data.to_json(orient='records', force_ascii=False).encode()
+            else:
+                body = json.dumps(data, ensure_ascii=False).encode()
+            contentType = 'application/json; charset=utf-8'
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        compressed = gzip.compress(body, 6) if len(body) >= REPORT_GZIP_MIN_SIZE else None
+        return etag, contentType, body, compressed
+
+    # 处理一个GET或HEAD请求，返回(状态码, 响应头, 响应体)
+    def respond(self, path, headers, head=False):
+        METRICS.add('report requests')
+        path = urlparse(path).path
+        with self._lock:
+            snapshot = self.snapshot
+            generation = self.generation
+            response = self.responses.get(path)
+        if snapshot is None:
+            return 503, {'Retry-After': '5'}, b''
+        if response is None:
+            with METRICS.timer('transform report'):
+                response = self.render(snapshot, path)
+            if response is None:
+                return 404, {'Content-Type': 'application/json; charset=utf-8'}, \
+                    json.dumps({'msg': '页面不存在'}, ensure_ascii=False).encode()
+            with self._lock:
+                if self.generation == generation:
+                    self.responses[path] = response
+        etag, contentType, body, compressed = response
+        result = {
+            'ETag': etag,
+            'Cache-Control': 'no-cache',
+            'Last-Modified': formatdate(snapshot[3], usegmt=True),
+            'Vary': 'Accept-Encoding',
+        }
+        # 弱校验：忽略W/前缀
+        match = [tag.strip().replace('W/', '', 1) for tag in (headers.get('If-None-Match') or '').split(',')]
+        if etag in match or '*' in match:
+            METRICS.add('report not modified')
+            return 304, result, b''
+        result['Content-Type'] = contentType
+        if compressed is not None and 'gzip' in (headers.get('Accept-Encoding') or ''):
+            result['Content-Encoding'] = 'gzip'
+            body = compressed
+        result['Content-Length'] = str(len(body))
+        return 200, result, b'' if head else body
+
+
+# 在本地启动报告服务，HTTP请求只读取ReportCache中的缓存
+def reportServer(cache, host='127.0.0.1', port=8080):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class ReportHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            logger.debug("%s - " + format, self.address_string(), *args)
+
+        def reply(self, head=False):
+            status, headers, body = cache.respond(self.path, self.headers, head)
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            if status != 304 and 'Content-Length' not in headers:
+                self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            if body:
+                self.wfile.write(body)
+
+        def do_GET(self):
+            self.reply()
+
+        def do_HEAD(self):
+            self.reply(head=True)
+
+    server = ThreadingHTTPServer((host, port), ReportHandler)
+    server.daemon_threads = True
+    return server
+
+
+# 命令行模式的登录：优先使用参数或环境变量中的账号，其次使用保存的账号信息
+def cliLogin(account=None, password=None):
+    account = account or os.environ.get('JYSC_ACCOUNT')
+    password = password or os.environ.get('JYSC_PASSWORD')
+    if not (account and password):
+        if not os.path.exists(CREDENTIALS_FILE):
+            raise SystemExit("未提供账号密码，也没有保存的账号信息")
+        account, password = load_credentials(CREDENTIALS_FILE, credentialKey())
+    return restoreLogin(account, password)
+
+
+# --page-size参数：auto或正整数
+def pageSizeArg(value):
+    if value == 'auto':
+        return value
+    if not value.isdigit() or int(value) <= 0:
+        raise argparse.ArgumentTypeError(f"分页大小应为auto或正整数: {value}")
+    return int(value)
+
+
+def parseArgs(argv=None):
+    parser = argparse.ArgumentParser(description="江西共青团大学习完成情况导出工具，不带参数运行时进入交互菜单")
+    parser.add_argument('--log-level', default=LOG_LEVEL, choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        type=str.upper, help="日志级别，也可以使用环境变量JYSC_LOG_LEVEL")
+    parser.add_argument('--log-format', default='text', choices=['text', 'json'], help="日志格式")
+    parser.add_argument('--profile', metavar='FILE',
+                        help="使用cProfile记录整个运行过程并保存到FILE，可用python -m pstats FILE查看")
+    subparsers = parser.add_subparsers(dest='command')
+
+    exportParser = subparsers.add_parser('export', help="非交互式批量导出")
+    exportParser.add_argument('--account', help="账号，也可以使用环境变量JYSC_ACCOUNT，默认使用保存的账号")
+    exportParser.add_argument('--password', help="密码，也可以使用环境变量JYSC_PASSWORD")
+    exportParser.add_argument('--period', default='latest',
+                              help="期数：latest（最近一期，默认）、all（全部）或逗号分隔的期数id")
+    exportParser.add_argument('--kind', nargs='+', choices=EXPORT_KINDS, default=EXPORT_KINDS,
+                              help="导出类型：finish完成名单、unfinish未完成名单、summary各团支部统计")
+    exportParser.add_argument('--branch', nargs='+',
+                              help="按团支部分别导出名单，参数为团支部名称关键字，all表示全部团支部")
+    exportParser.add_argument('--jobs', type=int, default=EXPORT_JOBS, help="同时进行的导出任务数")
+    exportParser.add_argument('--format', default='xlsx', choices=list(EXPORTERS),
+                              help="导出文件格式")
+    exportParser.add_argument('--page-size', type=pageSizeArg, default=PAGE_SIZE,
+                              help="名单接口的分页大小，auto为根据测量自动选择，也可以使用环境变量JYSC_PAGE_SIZE")
+    exportParser.add_argument('--workbook', action='store_true',
+                              help="与--branch一起使用：统计表和各团支部名单写入一个多工作表的xlsx汇总报告")
+    exportParser.add_argument('--processes', type=int, help="按团支部导出时生成文件的进程数，默认为CPU核心数")
+    exportParser.add_argument('--rate', type=float, default=REQUEST_RATE,
+                              help="每秒最多发起的请求数，0为不限制，也可以使用环境变量JYSC_RATE")
+    exportParser.add_argument('--max-in-flight', type=int, default=MAX_IN_FLIGHT,
+                              help="同时进行中的最大请求数，也可以使用环境变量JYSC_MAX_IN_FLIGHT")
+    exportParser.add_argument('--compact-rows', action='store_true', default=COMPACT_ROWS,
+                              help="名单只解码导出需要的字段，完成名单中大部分隐藏的列不再导出，也可以使用环境变量JYSC_COMPACT_ROWS=1")
+    exportParser.add_argument('--incremental', action='store_true',
+                              help="增量导出：记录名单快照，导出新完成名单，名单未变化的文件不再重写")
+    exportParser.add_argument('--snapshot', default=SNAPSHOT_FILE, help="增量导出使用的快照数据库文件")
+
+    trendParser = subparsers.add_parser('trend', help="多期完成率趋势分析和长期落后团支部排名")
+    trendParser.add_argument('--account', help="账号，也可以使用环境变量JYSC_ACCOUNT，默认使用保存的账号")
+    trendParser.add_argument('--password', help="密码，也可以使用环境变量JYSC_PASSWORD")
+    trendParser.add_argument('--period', default=str(TREND_PERIODS),
+                             help=f"期数：数字N表示最近N期（默认{TREND_PERIODS}），all（全部）或逗号分隔的期数id")
+    trendParser.add_argument('--threshold', type=float, default=TREND_THRESHOLD,
+                             help="完成率（%%）低于该值的期数计为落后")
+    trendParser.add_argument('--min-lagging', type=int, help="落后期数达到该值的团支部列入排名，默认为期数的一半")
+    trendParser.add_argument('--jobs', type=int, default=EXPORT_JOBS, help="同时获取的期数")
+    trendParser.add_argument('--format', default='xlsx', choices=list(EXPORTERS), help="导出文件格式")
+
+    watchParser = subparsers.add_parser('watch', help="定时轮询当前一期的完成情况，只拉取人数有变化的团支部名单")
+    watchParser.add_argument('--account', help="账号，也可以使用环境变量JYSC_ACCOUNT，默认使用保存的账号")
+    watchParser.add_argument('--password', help="密码，也可以使用环境变量JYSC_PASSWORD")
+    watchParser.add_argument('--interval', type=float, default=WATCH_INTERVAL, help="轮询间隔（秒）")
+    watchParser.add_argument('--count', type=int, default=0, help="轮询次数，0为一直运行直到按Ctrl+C")
+    watchParser.add_argument('--kind', nargs='+', choices=['finish', 'unfinish'], default=WATCH_KINDS,
+                             help="人数变化时拉取的名单：finish完成名单、unfinish未完成名单")
+    watchParser.add_argument('--jobs', type=int, default=EXPORT_JOBS, help="同时获取的团支部名单数")
+    watchParser.add_argument('--format', default='xlsx', choices=list(EXPORTERS), help="导出文件格式")
+    watchParser.add_argument('--snapshot', default=SNAPSHOT_FILE, help="保存名单快照和完成进度时间序列的数据库文件")
+
+    serveParser = subparsers.add_parser('serve', help="启动本地报告服务，供多人查看各团支部的统计和名单")
+    serveParser.add_argument('--account', help="账号，也可以使用环境变量JYSC_ACCOUNT，默认使用保存的账号")
+    serveParser.add_argument('--password', help="密码，也可以使用环境变量JYSC_PASSWORD")
+    serveParser.add_argument('--host', default='127.0.0.1', help="监听地址，0.0.0.0为允许局域网访问")
+    serveParser.add_argument('--port', type=int, default=8080, help="监听端口")
+    serveParser.add_argument('--refresh', type=float, default=REPORT_REFRESH, help="后台刷新数据的间隔（秒）")
+    serveParser.add_argument('--period', help="期数id，默认为最近一期（新的一期发布后自动切换）")
+    args = parser.parse_args(argv)
+    # 在获取数据之前检查导出格式的依赖，避免导出到一半才失败
+    fmt = getattr(args, 'format', None)
+    if fmt and not EXPORTERS[fmt].available():
+        parser.error(f"导出{fmt}格式需要安装{'、'.join(EXPORTERS[fmt].requires)}")
+    if args.command == 'export' and args.workbook:
+        # 汇总报告按团支部拆分完整名单，不记录快照
+        if not args.branch:
+            parser.error("--workbook需要与--branch一起使用")
+        if args.incremental:
+            parser.error("--workbook不能与--incremental一起使用")
+    return args
+
+
+def main(argv=None):
+    args = parseArgs(argv)
+    setupLogging(args.log_level, args.log_format)
+    profiler = None
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        return runCommand(args)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            logger.info(f"性能分析数据已保存到{args.profile}")
+        logger.info(METRICS.report())
+
+
+def runCommand(args):
+    if args.command is None:
+        main_menu()
+        return 0
+
+    if args.command == 'export':
+        global PAGE_SIZE, COMPACT_ROWS
+        PAGE_SIZE = args.page_size
+        COMPACT_ROWS = args.compact_rows
+        # 连接池需要容纳全部进行中的请求
+        configureClient(poolSize=max(POOL_SIZE, args.max_in_flight), rate=args.rate, maxInFlight=args.max_in_flight)
+        cookies, token = cliLogin(args.account, args.password)
+        store = SnapshotStore(args.snapshot) if args.incremental else None
+        files, failures = batchExport(cookies, token, args.period, args.kind, args.branch, args.jobs,
+                                        args.format, store, args.processes, args.workbook)
+        if store is not None:
+            store.close()
+        for filename in files:
+            print(filename)
+        logger.info(f"导出完成: 成功{len(files)}个，失败{len(failures)}个")
+        logger.info(f"接口缓存命中情况: {RESPONSE_CACHE.stats()}")
+        logger.info(f"限速状态: {getClient().limiter.stats()}")
+        logger.info(f"日志开销: {logStats()}")
+        return 1 if failures else 0
+
+    if args.command == 'trend':
+        cookies, token = cliLogin(args.account, args.password)
+        for filename in trendReport(cookies, token, args.period, args.threshold, args.min_lagging, args.jobs,
+                                    args.format):
+            print(filename)
+        logger.info(f"接口缓存命中情况: {RESPONSE_CACHE.stats()}")
+        return 0
+
+    if args.command == 'watch':
+        cookies, token = cliLogin(args.account, args.password)
+        store = SnapshotStore(args.snapshot)
+        try:
+            files = watch(cookies, token, store, args.interval, args.count, args.kind, args.format, args.jobs,
+                          lambda: cliLogin(args.account, args.password))
+        finally:
+            store.close()
+        for filename in files:
+            print(filename)
+        return 0
+
+    if args.command == 'serve':
+        cookies, token = cliLogin(args.account, args.password)
+        cache = ReportCache(cookies, token, args.period, args.refresh, lambda: cliLogin(args.account, args.password))
+        cache.start()
+        server = reportServer(cache, args.host, args.port)
+        host, port = server.server_address[:2]
+        logger.info(f"报告服务已启动: http://{host}:{port}/")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            logger.info("报告服务已停止")
+        finally:
+            cache.stop()
+            server.server_close()
+        return 0
+
+
+def main_menu():
+    import questionary
+    isLogin = False
+    credentials_file = CREDENTIALS_FILE
+    key = credentialKey()
 
     while True:
         if not isLogin and os.path.exists(credentials_file):
             use_saved = questionary.confirm("发现保存的账号信息，是否直接登录？").ask()
             if use_saved:
                 account, password = load_credentials(credentials_file, key)
-                cookies, token = login(account, password)
+                cookies, token = restoreLogin(account, password)
                 isLogin = True
             else:
                 os.remove(credentials_file)  # 删除旧的凭据文件
@@ -573,6 +2913,7 @@ def main_menu():
         if not isLogin:
             account = questionary.text("请输入账号：").ask()
             password = questionary.password("请输入密码：").ask()
+            # 手动输入的密码之后可能被保存，必须实际登录验证，不能使用缓存的登录状态
             cookies, token = login(account, password)
             isLogin = True
 
@@ -584,11 +2925,13 @@ def main_menu():
             '获取组织人数信息',
             '获取组织详细信息',
             '查看/导出大学习信息',
+            '多期完成率趋势分析',
             '退出'
         ]
         choice = questionary.select("请选择一个操作:", choices=choices).ask()
 
         if choice == '退出':
+            logger.info(f"接口缓存命中情况: {RESPONSE_CACHE.stats()}")
             break
         elif choice == '获取组织人数信息':
             getNumInfo(cookies, token, printInfo=True)
@@ -596,7 +2939,18 @@ def main_menu():
             getOrgInfo(cookies, token, printInfo=True)
         elif choice == '查看/导出大学习信息':
             studyMenu(cookies, token)
+        elif choice == '多期完成率趋势分析':
+            periods = questionary.text("分析最近多少期：", default=str(TREND_PERIODS),
+                                       validate=lambda text: text.isdigit() and int(text) > 0 or "请输入正整数").ask()
+            fmt = questionary.select("请选择导出格式:", choices=availableExporters(), default='xlsx').ask()
+            try:
+                files = trendReport(cookies, token, periods, fmt=fmt)
+            except ValueError as e:
+                print(e)
+                continue
+            for filename in files:
+                print(filename)
 
 
 if __name__ == "__main__":
-    main_menu()
+    sys.exit(main())
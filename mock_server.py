@@ -0,0 +1,234 @@
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+# 本地模拟的青年大学习后台接口，用于离线测试和性能基准测试，只依赖标准库
+# 用法：python mock_server.py --members 10000 --latency 0.05 --error-rate 0.01
+# 然后设置环境变量 JYSC_API_BASE=http://127.0.0.1:8000/api-org/ 运行main.py
+
+
+# 模拟的组织和名单数据，名单按需生成，同一组参数生成的数据总是相同
+class MockData:
+    def __init__(self, members=1000, branches=50, periods=5, finishRate=0.8, seed=0):
+        self.members = members
+        self.branches = [{'id': f'b{i}', 'orgName': f'团支部{i:03d}', 'college': f'学院{i % 10}'}
+                         for i in range(branches)]
+        self.branchIndex = {branch['id']: i for i, branch in enumerate(self.branches)}
+        self.finishRate = finishRate
+        self.seed = seed
+        # 最新一期尚未结束，其余为往期
+        now = datetime.now().replace(microsecond=0)
+        self.classes = []
+        for classId in range(periods, 0, -1):
+            start = now - timedelta(days=7 * (periods - classId) + 1)
+            self.classes.append({
+                'id': classId, 'title': f'{start.year}年第{classId}期', 'theme': f'主题{classId}',
+                'startTime': str(start), 'endTime': str(start + timedelta(days=7)), 'url': '', 'score': 20
+            })
+        self._lists = {}
+        self._lock = threading.Lock()
+
+    def branchOf(self, userIndex):
+        return self.branches[userIndex % len(self.branches)]
+
+    # 成员是否完成某一期，按成员和期数确定性地生成
+    def finished(self, classId, userIndex):
+        return random.Random(self.seed * 1_000_003 + classId * 7_919 + userIndex).random() < self.finishRate
+
+    # 某一期（某团支部）完成或未完成成员的序号列表
+    def userIndexes(self, classId, finished, parentId=None):
+        key = (classId, finished, parentId)
+        with self._lock:
+            if key not in self._lists:
+                if parentId:
+                    branch = self.branchIndex.get(parentId)
+                    candidates = range(branch, self.members, len(self.branches)) if branch is not None else ()
+                else:
+                    candidates = range(self.members)
+                self._lists[key] = [i for i in candidates if self.finished(classId, i) == finished]
+            return self._lists[key]
+
+    def finishRow(self, classId, userIndex):
+        branch = self.branchOf(userIndex)
+        return {
+            'id': classId * 10_000_000 + userIndex, 'classId': classId, 'score': 20,
+            'lev1': '共青团江西省委', 'lev2': '高校团工委', 'lev3': branch['college'], 'lev4': branch['orgName'],
+            'userid': f'u{userIndex}', 'nid': branch['id'], 'subOrg': '', 'nid1': 'n1', 'nid2': 'n2',
+            'nid3': 'c' + branch['college'][2:], 'status': 1, 'studyTime': 500,
+            'addTime': '2024-03-27 12:00:00', 'username': f'成员{userIndex}'
+        }
+
+    def notFinishRow(self, userIndex):
+        branch = self.branchOf(userIndex)
+        return {'userid': f'u{userIndex}', 'username': f'成员{userIndex}', 'areaid1': 'n1', 'areaid2': 'n2',
+                'areaid3': 'c' + branch['college'][2:], 'areaid4': branch['id'], 'areaid5': None}
+
+    def branchSummary(self, classId):
+        allNum = [0] * len(self.branches)
+        num = [0] * len(self.branches)
+        for i in range(self.members):
+            allNum[i % len(self.branches)] += 1
+        for i in self.userIndexes(classId, True):
+            num[i % len(self.branches)] += 1
+        return [{'id': branch['id'], 'orgName': branch['orgName'], 'allNum': allNum[i], 'num': num[i],
+                 'occupancy': round(num[i] * 100 / allNum[i], 4) if allNum[i] else 0}
+                for i, branch in enumerate(self.branches)]
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        self.handle_api()
+
+    def do_POST(self):
+        self.handle_api()
+
+    # 请求参数可能在查询字符串、JSON请求体或表单请求体中
+    def params(self):
+        url = urlparse(self.path)
+        params = dict(parse_qsl(url.query))
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        if body:
+            try:
+                params.update(json.loads(body))
+            except ValueError:
+                params.update(parse_qsl(body.decode()))
+        return params
+
+    def send(self, status, payload=None, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode() if payload is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json;charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def reply(self, data, headers=None):
+        self.send(200, {'code': 200, 'msg': '请求成功', 'data': data}, headers)
+
+    def handle_api(self):
+        server = self.server
+        params = self.params()
+        endpoint = urlparse(self.path).path.split('/api-org/')[-1].lstrip('/')
+        server.count(endpoint)
+        time.sleep(server.latency)
+        if server.errorRate and server.random.random() < server.errorRate:
+            server.count('errors')
+            return self.send(503)
+
+        if endpoint == 'user/login':
+            return self.reply({'token': server.token, 'user': {'userName': params.get('account', '')}},
+                              {'Set-Cookie': 'JSESSIONID=mock; Path=/'})
+        if self.headers.get('Authorization') != server.token:
+            return self.send(200, {'code': 401, 'msg': '登录已过期'})
+
+        data = server.data
+        classId = int(params.get('classId') or data.classes[0]['id'])
+        if endpoint == 'org/getMyOrgNum':
+            return self.reply({'members': data.members, 'cadre': len(data.branches), 'orgNum': len(data.branches)})
+        if endpoint == 'org/getMyOrgInfo':
+            return self.reply({'parentIdName': '共青团江西省委', 'orgName': '模拟团委', 'num': data.members})
+        if endpoint == 'clazz/getClass':
+            return self.reply(data.classes)
+        if endpoint == 'record/getOrgClassRecord':
+            return self.reply(data.branchSummary(classId))
+        if endpoint == 'record/getOrgLowerClassRecordSummary':
+            num = len(data.userIndexes(classId, True))
+            title = next((item['title'] for item in data.classes if item['id'] == classId), '')
+            return self.reply({'id': str(classId), 'allNum': data.members, 'num': num, 'title': title,
+                               'orgName': '模拟团委', 'occupancy': round(num * 100 / max(data.members, 1), 4)})
+        if endpoint in ('record/getUserClassRecord', 'record/getUserNotFinishRecording'):
+            finished = endpoint == 'record/getUserClassRecord'
+            indexes = data.userIndexes(classId, finished, params.get('parentId'))
+            pageSize = max(1, int(params.get('pageSize') or 10))
+            if server.maxPageSize:
+                pageSize = min(pageSize, server.maxPageSize)
+            page = max(1, int(params.get('currentPage') or 1))
+            chunk = indexes[(page - 1) * pageSize:page * pageSize]
+            # 按返回行数模拟服务器的查询耗时
+            time.sleep(server.rowLatency * len(chunk))
+            rows = [data.finishRow(classId, i) if finished else data.notFinishRow(i) for i in chunk]
+            return self.reply({'page': {'currentPage': page, 'pageSize': pageSize, 'totalCount': len(indexes),
+                                        'totalPages': -(-len(indexes) // pageSize)}, 'data': rows})
+        self.send(404, {'code': 404, 'msg': '接口不存在'})
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, data, latency=0.0, rowLatency=0.0, errorRate=0.0, maxPageSize=None, seed=0,
+                 verbose=False):
+        super().__init__(address, MockHandler)
+        self.data = data
+        self.latency = latency
+        self.rowLatency = rowLatency
+        self.errorRate = errorRate
+        self.maxPageSize = maxPageSize
+        self.verbose = verbose
+        self.random = random.Random(seed)
+        self.token = 'mock-token'
+        self.requests = {}
+        self._lock = threading.Lock()
+
+    def count(self, name):
+        with self._lock:
+            self.requests[name] = self.requests.get(name, 0) + 1
+
+    @property
+    def apiBase(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/api-org/'
+
+
+# 在后台线程中启动模拟服务器，port为0时使用随机端口
+def start(host='127.0.0.1', port=0, members=1000, branches=50, periods=5, finishRate=0.8, latency=0.0,
+          rowLatency=0.0, errorRate=0.0, maxPageSize=None, seed=0, verbose=False):
+    data = MockData(members, branches, periods, finishRate, seed)
+    server = MockServer((host, port), data, latency, rowLatency, errorRate, maxPageSize, seed, verbose)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run(argv=None):
+    parser = argparse.ArgumentParser(description="本地模拟的青年大学习后台接口")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--members', type=int, default=1000, help="团员总数")
+    parser.add_argument('--branches', type=int, default=50, help="团支部数")
+    parser.add_argument('--periods', type=int, default=5, help="期数")
+    parser.add_argument('--finish-rate', type=float, default=0.8, help="每期的完成比例")
+    parser.add_argument('--latency', type=float, default=0.0, help="每个请求的固定延迟（秒）")
+    parser.add_argument('--row-latency', type=float, default=0.0, help="名单接口每返回一行增加的延迟（秒）")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="返回503的请求比例")
+    parser.add_argument('--max-page-size', type=int, help="名单接口每页最多返回的行数")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--verbose', action='store_true', help="输出每个请求的访问日志")
+    args = parser.parse_args(argv)
+
+    server = start(args.host, args.port, args.members, args.branches, args.periods, args.finish_rate, args.latency,
+                   args.row_latency, args.error_rate, args.max_page_size, args.seed, args.verbose)
+    print(f"模拟服务器已启动: {server.apiBase}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run(sys.argv[1:]))